@@ -7,6 +7,45 @@
         seed: (Optional) Sets random seed. 
         load: Loads entourages in a new layer.
         orient: (Re)orients the entourages to camera angle.
+        follow: (Optional) Keeps entourages oriented as the camera moves.
+        perspective: (Optional) Turns each entourage toward the camera.
+        target: (Optional) Turns entourages toward this point instead.
+        cull: (Optional) Skips entourages outside the view until they come
+            into view and lowers the detail of distant ones.
+        region: (Optional) Closed planar curves or meshes to populate
+            instead of point.
+        resolve: (Optional) Nudges or drops entourages that overlap.
+        spread: (Optional) Keeps identical images at least this far apart.
+        weights: (Optional) Mix of images as pattern:weight, where the
+            pattern matches subfolder or file names, e.g. "cyclists:30".
+        statsLog: (Optional) A file to append the stats of every run to,
+            as JSON lines.
+        plan: (Optional) A placement plan made by planner.py, loaded
+            instead of path, point and imgHeight.
+        export: (Optional) A .gltf or .obj file to write the loaded
+            entourages to, when it is connected or changed and whenever
+            they are loaded, oriented or deleted.
+        background: (Optional) Loads in chunks while Rhino stays
+            responsive, showing the progress in the component message.
+        cancel: Stops a background load and removes what it placed.
+        mirror: (Optional) A local folder to copy the images into, so that
+            libraries on network shares are only read once.
+        proxy: (Optional) Works with downsampled copies of the images.
+            Turn it off to swap every entourage back to full resolution,
+            e.g. before rendering.
+        preview: (Optional) Draws the entourages without adding them to
+            the document until bake is pressed.
+        bake: Adds the previewed entourages to the document.
+        merge: (Optional) Loads and bakes the entourages as one mesh per
+            image instead of one picture frame each.
+        select: (Optional) Points, boxes, closed curves or meshes to find
+            loaded entourages in.
+        radius: (Optional) Selects the entourages within this distance of
+            the select points instead of the nearest one.
+        action: (Optional) "delete" or "orient" the selected entourages.
+    Output:
+        stats: Timings of each phase and counters of the last run.
+        selected: The ids of the entourages found by select.
 """
 __author__ = "Vincent Mai"
 __version__ = "0.5.0"
@@ -19,35 +58,86 @@ import scriptcontext as sc
 import Rhino.Geometry as rg
 import ghpythonlib.components as ghc
 import Grasshopper.Kernel as ghk
-import random
 import os
-from ghutil import RhinoDocContext, NewLayerContext, TreeHandler
+import collections
+import hashlib
+import tempfile
+from ghutil import RhinoDocContext, LayerContext, NewLayerContext, TreeHandler
+from ghutil import ViewChangeWatcher, BackgroundJob, PreviewConduit
+from ghutil import quadMesh
+from billboard import BillboardCache, yawDeltas, yawVectors
+from culling import CULLED, cullLevels, lodCounts
+from scene import diffEntries, keepImages, keepShifted, rekeyEntries
+from region import poissonDisk
+from spatial import DROPPED, resolveOverlaps, spreadAssign
+from sampling import CounterRandom, anchorKey, cachedTable, fileWeights
+from sampling import parseRules
+from persist import internPaths, packState, unpackState
+from store import EntourageStore, denseColumns, meshSlots
+from stats import Stats, appendLog
+from planner import facePlan, layoutPlan, loadPlan, pngSize
+from preview import previewGroups, quadBounds, quadVertices
+from export import exportPlan, groupByImage
+from prewarm import prewarm
+from mirror import MirrorCache
 
 RANDOM_SEED = 0
 UNIT_Z = (0, 0, 1)
+FOLLOW_INTERVAL = 0.3 # seconds of camera inactivity before reorienting
+FOLLOW_THRESHOLD = 2.0 # degrees the camera has to turn before reorienting
+YAW_TOLERANCE = 1e-3 # degrees an entourage may be off before it is turned
+LOD_PIXELS = (64, 16) # minimum screen height (in pixels) per texture level
+LOD_SCALES = (1.0, 0.25) # texture scale per level, coarser levels are flat
+PROXY_LOD = 1 # the coarsest level textured in proxy mode
+IMAGE_SIZES = {}
+FILE_LISTS = {}
+STATE_SECTION = "AutoEntourage" # document strings holding the saved state
+STATE_ENTRIES = ("entourages", "view") # suffixed with the layer name
+STATS = Stats()
+CHUNK_SIZE = 500 # entourages placed per idle step in the background
 
-class Struct:
+class Struct(object):
     """Cache the state of the loaded entourages
     """
+    __slots__ = ("cameraDir", "billboard", "target", "deferred", "layerName",
+                 "store", "proxy", "merged", "picks")
+
     def __init__(self):
-        self.pictureframeIds = None
-        self.point = None
-        self.cameraDir = None
+        self.clear()
 
-    def cache(self, pictureframeIds=None, point=None, cameraDir=None):
+    def cache(self, cameraDir=None, billboard=None, target=None,
+              deferred=None, layerName=None, store=None, proxy=None):
         """Caches the current state of the loaded entourages
 
         Args:
-            pictureframeIds (gh.DataTree): guid of pictureframe
-            point (gh.DataTree): anchor points for pictureframes/entourages
             cameraDir (rg.Vector3d): the cameraDirection of active viewport
+            billboard (BillboardCache): per-anchor yaws in perspective mode
+            target (rg.Point3d): the point entourages face in perspective mode
+            deferred (list of int): the culled entourages of store waiting
+                to come into view, empty once all are placed
+            layerName (str): the layer of the entourages
+            store (EntourageStore): flat arrays of the placed entourages
+            proxy (bool): whether the frames show the proxy textures
         """
-        if pictureframeIds:
-            self.pictureframeIds = pictureframeIds
-        if point:
-            self.point = point
         if cameraDir:
             self.cameraDir = cameraDir
+        if billboard:
+            self.billboard = billboard
+        if target:
+            self.target = target
+        if deferred is not None:
+            self.deferred = deferred
+        if layerName:
+            self.layerName = layerName
+        if store:
+            self.store = store
+        if proxy is not None:
+            self.proxy = proxy
+
+    def clear(self):
+        """clears all attributes"""
+        for attr in self.__slots__:
+            setattr(self, attr, None)
 
 def addPictureFrame(path, point, orientation, width, height):
     """Calls rhinoscriptsyntax's addPictureFrame method, return objectID
@@ -65,14 +155,142 @@ def addPictureFrame(path, point, orientation, width, height):
         (RhinoObjects.Id) the guid of the pictureframe
     """
     with RhinoDocContext():
-        xAxis = rs.VectorRotate(orientation, 90, UNIT_Z)
-        yAxis = rg.Vector3d(*UNIT_Z)
-        point -= 0.5*xAxis*width
-        plane = rg.Plane(point, xAxis, yAxis)
+        plane = framePlane(point, orientation, width)
         objId = sc.doc.ActiveDoc.Objects.AddPictureFrame(plane, path, False,
                                                          width, height, False, False)
         return objId 
-        
+
+def addProxyFrame(point, orientation, width, height):
+    """Adds a flat rectangle in place of a picture frame, return objectID
+
+    Args:
+        point (rg.Point3d): anchor point for the proxy
+        orietation (rg.Vector3d): the orientation of the proxy
+        width (float): width of the proxy
+        height (float): height of the proxy
+    Returns:
+        (RhinoObjects.Id) the guid of the proxy
+    """
+    with RhinoDocContext():
+        plane = framePlane(point, orientation, width)
+        surface = rg.PlaneSurface(plane, rg.Interval(0, width),
+                                  rg.Interval(0, height))
+        return sc.doc.Objects.AddSurface(surface)
+
+def framePlane(point, orientation, width):
+    """Returns the base plane of a vertical frame centered on the anchor
+
+    Args:
+        point (rg.Point3d): anchor point for the frame
+        orietation (rg.Vector3d): the orientation of the frame
+        width (float): width of the frame
+    """
+    xAxis = rs.VectorRotate(orientation, 90, UNIT_Z)
+    yAxis = rg.Vector3d(*UNIT_Z)
+    point -= 0.5*xAxis*width
+    return rg.Plane(point, xAxis, yAxis)
+
+def lodTexture(path, lod):
+    """Returns the path to the texture of a given level of detail
+
+    Downsampled textures are generated once and kept in the temp folder
+    until the source image changes.
+
+    Args:
+        path (str): the path to the full resolution .png file
+        lod (int): the level of detail, 0 being full resolution
+    """
+    scale = LOD_SCALES[lod]
+    if scale == 1:
+        return path
+    folder = os.path.join(tempfile.gettempdir(), "auto_entourage",
+                          "lod{}".format(lod))
+    key = hashlib.md5(path.encode("utf-8")).hexdigest()[:8]
+    out = os.path.join(folder, key + "_" + os.path.basename(path))
+    if not os.path.exists(out) or os.path.getmtime(out) < os.path.getmtime(path):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        bmp = System.Drawing.Bitmap.FromFile(path)
+        small = System.Drawing.Bitmap(bmp, max(1, int(bmp.Width*scale)),
+                                      max(1, int(bmp.Height*scale)))
+        small.Save(out, System.Drawing.Imaging.ImageFormat.Png)
+        small.Dispose()
+        bmp.Dispose()
+    return out
+
+def frameLevels(levels, proxy):
+    """Returns the levels of detail raised to at least PROXY_LOD in proxy
+    mode, leaving culled and dropped entourages as they are"""
+    if not proxy:
+        return levels
+    return [lv if lv < 0 else max(lv, PROXY_LOD) for lv in levels]
+
+def textureMemory(paths, proxy):
+    """Returns the bytes the unique textures of paths take uncompressed
+
+    Args:
+        paths (list of str): paths to the full resolution .png images
+        proxy (bool): counts the proxy textures instead
+    """
+    total = 0
+    for path in set(paths):
+        if path is None:
+            continue
+        try:
+            width, height = imageSize(lodTexture(path, PROXY_LOD) if proxy
+                                      else path)
+        except:
+            continue
+        total += 4*width*height
+    return total
+
+def reportTextures(paths, proxy):
+    """Counts and prints the texture memory of the images in a mode"""
+    size = textureMemory(paths, proxy)
+    STATS.count("texture bytes", size)
+    print("Texture memory ({}): {:.1f} MB".format(
+        "proxy" if proxy else "full resolution", size / 1e6))
+
+def swapTextures(data, proxy):
+    """Retargets every placed picture frame to its proxy or full
+    resolution texture without placing it again
+
+    Frames are grouped by material, so each material is modified once
+    and the viewport is redrawn once. The bitmap and the transparency
+    texture are swapped together, as placeMerged sets both.
+
+    Args:
+        data (Struct): the current state of the entourages
+        proxy (bool): swaps to the proxy textures, or back to full
+            resolution
+    """
+    store = data.store
+    targets = {}
+    seen = set()
+    with RhinoDocContext():
+        objects = sc.doc.Objects
+        for i, guid in enumerate(store.guids):
+            path = store.image(i)
+            if guid is None or path is None or guid in seen:
+                continue
+            seen.add(guid) # merged meshes hold many entourages
+            obj = objects.FindId(guid)
+            if obj is None or obj.Attributes.MaterialIndex < 0:
+                continue # flat proxies of the coarsest level are untextured
+            targets[obj.Attributes.MaterialIndex] = path
+        textures = dict((path, lodTexture(path, PROXY_LOD) if proxy else path)
+                        for path in set(targets.values()))
+        rs.EnableRedraw(False)
+        materials = sc.doc.Materials
+        for index, path in targets.items():
+            material = materials[index]
+            material.SetBitmapTexture(textures[path])
+            material.SetTransparencyTexture(textures[path])
+            materials.Modify(material, index, True)
+        rs.EnableRedraw(True)
+    data.proxy = proxy
+    STATS.count("textures retargeted", len(targets))
+    reportTextures(textures, proxy)
             
 def getFiles(path):
     """Returns a list of paths to PNGs from a directory
@@ -80,10 +298,17 @@ def getFiles(path):
     Args:
         path (str): the directory containing trimmed .png image
     Returns:
-        list of absolute paths to .png files
+        list of absolute paths to .png files, sorted so that hashed picks
+        do not depend on the file system
+    Notes:
+        Lists are cached in FILE_LISTS, which is cleared on every load
     """
-    fileList = os.listdir(path)
-    return [path + file for file in fileList if file.endswith(".png")]
+    if path not in FILE_LISTS:
+        STATS.count("file lists read")
+        fileList = sorted(os.listdir(path))
+        FILE_LISTS[path] = [path + file for file in fileList
+                            if file.endswith(".png")]
+    return FILE_LISTS[path]
         
 def imageSize(path):
     """Returns the height and width of the image from the file path
@@ -92,9 +317,15 @@ def imageSize(path):
         path (str): the path to the .png file
     Returns:
         (width, height) of the .png
+    Notes:
+        Sizes are cached in IMAGE_SIZES, which is cleared on every load
     """
-    bmp = System.Drawing.Bitmap.FromFile(path)
-    return (bmp.Width, bmp.Height)
+    if path not in IMAGE_SIZES:
+        STATS.count("images decoded")
+        bmp = System.Drawing.Bitmap.FromFile(path)
+        IMAGE_SIZES[path] = (bmp.Width, bmp.Height)
+        bmp.Dispose()
+    return IMAGE_SIZES[path]
         
 def scaleImage(baseWidth, baseHeight, targetHeight):
     """Scales the input width and height by the target height
@@ -108,6 +339,27 @@ def scaleImage(baseWidth, baseHeight, targetHeight):
     """
     factor = targetHeight / baseHeight
     return baseWidth*factor, targetHeight
+
+def scaleImages(path, imgHeight):
+    """Returns the widths of images scaled to their target heights
+
+    Every image is read once however many anchors it is assigned to.
+
+    Args:
+        path (list of str): paths to the .png images
+        imgHeight (list of float): the target heights
+    Returns:
+        list of scaled widths, None where the image cannot be read
+    """
+    factors = {}
+    for p in set(path):
+        try:
+            baseWidth, baseHeight = imageSize(p)
+            factors[p] = float(baseWidth) / baseHeight
+        except:
+            factors[p] = None
+    return [None if factors[p] is None else factors[p]*h
+            for p, h in zip(path, imgHeight)]
             
 def getCameraDirection():
     """Returns the viewport camera direction (projected on XY plane)
@@ -120,8 +372,106 @@ def getCameraDirection():
     projCameraDir.Unitize()
     return projCameraDir
 
+def getEye(target=None):
+    """Returns the point entourages face in perspective mode
+
+    Args:
+        target (rg.Point3d): (Optional) overrides the camera location
+    Returns:
+        (rg.Point3d) the target, or the camera location of active viewport
+    """
+    if target is not None:
+        return target
+    return sc.doc.Views.ActiveView.ActiveViewport.CameraLocation
+
+def billboardOrientation(point, billboard, eye):
+    """Returns a tree of per-anchor orientations facing the eye point
+
+    Args:
+        point (gh.DataTree): anchor points of the entourages
+        billboard (BillboardCache): yaw cache of the same anchors
+        eye (rg.Point3d): the point to face
+    """
+    yaws = billboard.yawsFor((eye.X, eye.Y))
+    vectors = [rg.Vector3d(*v) for v in yawVectors(yaws)]
+    return TreeHandler.fromFlat(vectors, point)
+
+def getViewClip():
+    """Returns the world to clip matrix and the pixel height of the
+    active viewport
+
+    Returns:
+        (list, int) the 4x4 row-major matrix and the viewport height
+    """
+    viewport = sc.doc.Views.ActiveView.ActiveViewport
+    xform = viewport.GetTransform(Rhino.DocObjects.CoordinateSystem.World,
+                                  Rhino.DocObjects.CoordinateSystem.Clip)
+    matrix = [[xform[i, j] for j in range(4)] for i in range(4)]
+    return matrix, viewport.Size.Height
+
+def cullEntourages(bounds):
+    """Returns the level of detail of every entourage, or CULLED if it is
+    outside the active view
+
+    Args:
+        bounds (list): (x, y, z, width, height) per entourage, or None if
+            the size is unknown (never culled)
+    """
+    known = [b for b in bounds if b is not None]
+    matrix, viewHeight = getViewClip()
+    levels = iter(cullLevels(matrix, viewHeight,
+                             *(list(c) for c in zip(*known)),
+                             thresholds=LOD_PIXELS) if known else [])
+    return [0 if b is None else next(levels) for b in bounds]
+
+def entourageBounds(path, point, imgHeight):
+    """Returns the anchor and scaled size of every entourage
+
+    Args:
+        path (list of str): paths to the .png images
+        point (list of rg.Point3d): the anchor points
+        imgHeight (list of float): the target heights
+    Returns:
+        list of (x, y, z, width, height), None where the image cannot
+        be read
+    """
+    widths = scaleImages(path, imgHeight)
+    return [None if w is None else (p.X, p.Y, p.Z, w, h)
+            for p, w, h in zip(point, widths, imgHeight)]
+
+def placeDeferred(data):
+    """Places the culled entourages that have come into view
+
+    Args:
+        data: the cache data of entourages
+    """
+    if not data.deferred:
+        return
+    store = data.store
+    paths = [store.image(i) for i in data.deferred]
+    points = [rg.Point3d(*store.anchor(i)) for i in data.deferred]
+    heights = [store.heights[i] for i in data.deferred]
+    levels = cullEntourages(entourageBounds(paths, points, heights))
+    placed, guids, remaining = [], [], []
+    with LayerContext(data.layerName):
+        for i, path, pt, h, lod in zip(data.deferred, paths, points, heights,
+                                       levels):
+            lod = frameLevels([lod], data.proxy)[0]
+            if lod == CULLED:
+                remaining.append(i)
+                continue
+            if data.billboard is not None:
+                yaw = data.billboard.yaws[i]
+                orientation = rg.Vector3d(*yawVectors([yaw])[0])
+            else:
+                orientation = data.cameraDir
+            placed.append(i)
+            guids.append(placeImage.func(path, pt, orientation, h, lod))
+    store.replaceGuids(placed, guids)
+    data.deferred = remaining
+
 @TreeHandler
-def placeImage(path, point, orientation, imgHeight):
+def placeImage(path, point, orientation, imgHeight, lod=0):
     """Orients, scales, and places the input image as a PictureFrame
     
     Orients the input image based on orientation, scales it to the
@@ -132,33 +482,275 @@ def placeImage(path, point, orientation, imgHeight):
         point (rg.Point3d): the anchor to center the PictureFrame
         orientation (rg.Vector3d): the normal vector of the PictureFrame
         imgHeight (float): the target height to scale to
+        lod (int): the level of detail, or CULLED or DROPPED to skip the
+            image
     Notes:
         Skips images should they failed to be added to Rhino document
     """
+    if lod in (CULLED, DROPPED):
+        return None
     try:
         width, height = scaleImage(*imageSize(path), targetHeight=imgHeight)
-        return addPictureFrame(path, point, orientation, width, height)
+        if lod < len(LOD_SCALES):
+            return addPictureFrame(lodTexture(path, lod), point, orientation,
+                                   width, height)
+        return addProxyFrame(point, orientation, width, height)
     except:
+        STATS.count("images failed")
         print("Failed to process {}".format(path))
                     
         
+def regionLoops(region):
+    """Returns the boundary loops of a region projected on the XY plane
+
+    Args:
+        region (rg.Curve or rg.Mesh): a closed planar curve, or a mesh
+    Returns:
+        list of loops as lists of (x, y)
+    """
+    if isinstance(region, rg.Mesh):
+        return [[(p.X, p.Y) for p in loop]
+                for loop in region.GetNakedEdges() or []]
+    with RhinoDocContext():
+        tolerance = sc.doc.ModelAbsoluteTolerance
+        angleTolerance = sc.doc.ModelAngleToleranceRadians
+    polyline = region.ToPolyline(tolerance, angleTolerance, 0, 0)
+    return [[(polyline.Point(i).X, polyline.Point(i).Y)
+             for i in range(polyline.PointCount)]]
+
+def regionSpacing(path, imgHeight):
+    """Returns the spacing of anchors in a region: the width of the widest
+    image in the library scaled to the tallest target height
+
+    Sizes are read from the PNG headers, so the library is not decoded.
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        imgHeight (gh.DataTree): the target heights
+    """
+    height = max(imgHeight.AllData())
+    aspect = None
+    for f in set(f for p in path.AllData() for f in getFiles(p)):
+        try:
+            width, h = pngSize(f)
+        except (IOError, OSError, ValueError):
+            continue
+        STATS.count("image headers read")
+        if h > 0 and (aspect is None or float(width) / h > aspect):
+            aspect = float(width) / h
+    return aspect*height if aspect else height
+
 @TreeHandler
-def loadImage(path, num, seed):
-    """Randomly choose a number of images from the given file path
-    
+def populateRegion(region, spacing, seed):
+    """Returns anchor points spread over a region as blue noise
+
+    Anchors are at least spacing apart. They lie at the elevation of a
+    curve's start point, or on the surface of a mesh.
+
+    Args:
+        region (rg.Curve or rg.Mesh): a closed planar curve, or a mesh
+        spacing (float): the minimum distance between anchors
+        seed (int): random seed to randomize the anchors
+    Returns:
+        a list of rg.Point3d
+    """
+    samples = poissonDisk(regionLoops(region), spacing, seed)
+    if not isinstance(region, rg.Mesh):
+        z = region.PointAtStart.Z
+        return [rg.Point3d(x, y, z) for x, y in samples]
+    top = region.GetBoundingBox(True).Max.Z + 1
+    down = -rg.Vector3d(*UNIT_Z)
+    anchors = []
+    for x, y in samples:
+        ray = rg.Ray3d(rg.Point3d(x, y, top), down)
+        t = rg.Intersect.Intersection.MeshRay(region, ray)
+        if t >= 0:
+            anchors.append(ray.PointAt(t))
+    return anchors
+
+@TreeHandler
+def loadImage(path, point, seed):
+    """Randomly chooses an image for an anchor from the given file path
+
+    The choice is hashed from the seed and the anchor coordinates, so it
+    does not depend on the other anchors or their order.
+
     Args:
         path (str): path to the image directory
-        num (int): the number of images to load
+        point (rg.Point3d): the anchor of the image
         seed (int): random seed to randomize loading
     Returns:
-        a list of images loaded from the given directory
+        the path to an image in the given directory
     """
-    random.seed(seed)
     imgList = getFiles(path)
-    imgList = random.sample(imgList, len(imgList))
-    return [imgList[i % len(imgList)] for i in range(num)]
+    rnd = CounterRandom(anchorKey(seed, point.X, point.Y, point.Z))
+    return imgList[rnd.randrange(len(imgList))]
+
+def weightedLibrary(path, rules):
+    """Returns the PNGs in a directory and its subfolders with their weights
+
+    Args:
+        path (str): the directory containing trimmed .png image
+        rules (list of (str, float)): patterns and their weights
+    Returns:
+        (files, weights) as tuples, so they can key the alias table cache
+    """
+    files = list(getFiles(path))
+    folders = [os.path.basename(os.path.normpath(path))]*len(files)
+    for name in sorted(os.listdir(path)):
+        folder = os.path.join(path, name)
+        if os.path.isdir(folder):
+            found = getFiles(folder + os.sep)
+            files += found
+            folders += [name]*len(found)
+    weights = fileWeights([os.path.basename(f) for f in files], folders,
+                          rules)
+    return tuple(files), tuple(weights)
+
+def loadWeighted(path, point, rules, seed):
+    """Draws an image for every anchor in proportion to the weights
+
+    Draws are hashed from the seed and the anchor coordinates, like in
+    loadImage.
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        point (gh.DataTree): the anchor points
+        rules (list of (str, float)): patterns and their weights
+        seed (int): random seed to randomize loading
+    Returns:
+        a gh.DataTree of image paths matched to point
+    """
+    columns, shape = TreeHandler.match(path, point)
+    return TreeHandler.fromFlat(weightedImages(columns[0], columns[1], rules,
+                                               seed), shape)
+
+def weightedImages(folders, anchors, rules, seed):
+    """Returns the weighted draw of every matched anchor, see loadWeighted
+
+    Args:
+        folders (list of str): the image directory of every anchor
+        anchors (list of rg.Point3d): the anchor points
+        rules (list of (str, float)): patterns and their weights
+        seed (int): random seed to randomize loading
+    """
+    tables = {}
+    imgs = []
+    for folder, p in zip(folders, anchors):
+        if folder not in tables:
+            files, weights = weightedLibrary(folder, rules)
+            tables[folder] = (files, cachedTable(files, weights))
+        files, table = tables[folder]
+        rnd = CounterRandom(anchorKey(seed, p.X, p.Y, p.Z))
+        imgs.append(files[table.draw(rnd)])
+    return imgs
+
+def spreadImages(path, point, radius, seed, rules=None):
+    """Assigns images to anchors so that identical images are not within
+    radius of each other
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        point (gh.DataTree): the anchor points
+        radius (float): the minimum distance between identical images
+        seed (int): random seed to randomize the assignment
+        rules (list of (str, float)): (Optional) limits the images to
+            those with a positive weight
+    Returns:
+        a gh.DataTree of image paths matched to point
+    """
+    columns, shape = TreeHandler.match(path, point)
+    return TreeHandler.fromFlat(spreadPicks(columns[0], columns[1], radius,
+                                            seed, rules), shape)
+
+def spreadPicks(folders, anchors, radius, seed, rules=None):
+    """Returns the image of every matched anchor, see spreadImages
+
+    Args:
+        folders (list of str): the image directory of every anchor
+        anchors (list of rg.Point3d): the anchor points
+        radius (float): the minimum distance between identical images
+        seed (int): random seed to randomize the assignment
+        rules (list of (str, float)): (Optional) limits the images to
+            those with a positive weight
+    """
+    libraries = {}
+    for folder in set(folders):
+        if rules:
+            files, weights = weightedLibrary(folder, rules)
+            libraries[folder] = [f for f, w in zip(files, weights) if w > 0]
+        else:
+            libraries[folder] = getFiles(folder)
+    return spreadAssign([p.X for p in anchors], [p.Y for p in anchors],
+                        [libraries[folder] for folder in folders],
+                        radius, seed)
+
+def warmTextures(paths):
+    """Reads the chosen images concurrently before the picture frames are
+    created, so that AddPictureFrame finds them in the OS cache
+
+    Args:
+        paths (list of str): the images about to be placed
+    """
+    with STATS.phase("prewarm"):
+        files, size, seconds, failed = prewarm(paths)
+    STATS.count("prewarmed files", files)
+    STATS.count("prewarmed bytes", size)
+    STATS.count("prewarm failures", failed)
+    print("Prewarmed {} images ({:.1f} MB) in {:.2f} s, {} failed".format(
+        files, size / 1e6, seconds, failed))
 
-def populate(path, imgHeight, point, layerName, seed, data):
+def mirrorFiles(files, root):
+    """Returns the local copies of files in a mirror cache
+
+    Missing copies are made concurrently, then the least recently used
+    entries above the size limit are removed.
+
+    Args:
+        files (list of str): the paths to the source images
+        root (str): the mirror cache directory
+    Returns:
+        list of local paths matched to files
+    """
+    cache = MirrorCache(root)
+    with STATS.phase("mirror"):
+        local = cache.fetchAll(files)
+        if cache.misses:
+            cache.trim(local.values())
+    STATS.count("mirror hits", cache.hits)
+    STATS.count("mirror misses", cache.misses)
+    STATS.count("mirror bytes copied", cache.copied)
+    STATS.count("mirror evicted", cache.evicted)
+    print("Mirror hits: {}, misses: {} ({:.1f} MB copied)".format(
+        cache.hits, cache.misses, cache.copied / 1e6))
+    return [local[f] for f in files]
+
+def resolveEntourages(imgs, point, imgHeight, seed):
+    """Nudges or drops the anchors of overlapping entourages
+
+    Args:
+        imgs (gh.DataTree): paths to the .png images
+        point (gh.DataTree): the anchor points
+        imgHeight (gh.DataTree): the target heights
+        seed (int): random seed for the order anchors are resolved in
+    Returns:
+        (point, dropped) the resolved anchors matched to imgs, and a flag
+        per matched entourage
+    """
+    columns, shape = TreeHandler.match(imgs, point, imgHeight)
+    anchors = columns[1]
+    widths = scaleImages(columns[0], columns[2])
+    xs, ys, dropped = resolveOverlaps([p.X for p in anchors],
+                                      [p.Y for p in anchors], widths, seed)
+    moved = sum(1 for p, x, y, d in zip(anchors, xs, ys, dropped)
+                if not d and (x != p.X or y != p.Y))
+    print("Resolver removed: {}, moved: {}".format(sum(dropped), moved))
+    resolved = [rg.Point3d(x, y, p.Z) for p, x, y in zip(anchors, xs, ys)]
+    return TreeHandler.fromFlat(resolved, shape), dropped
+
+def populate(path, imgHeight, point, layerName, seed, data,
+             perspective=False, target=None, cullView=False, resolve=False,
+             spread=None, weights=None, mirror=None, proxy=False):
     """Populates a Rhino document with entourages (vertical PictureFrames)
     and caches the current state
     
@@ -168,14 +760,615 @@ def populate(path, imgHeight, point, layerName, seed, data):
         point (rg.Point3d): the anchor point of the picture frame
         seed (int): the random seed for loadImage and populateRegion
         data (Struct): the current state of the entourages
+        perspective (bool): turns each entourage toward the camera location
+        target (rg.Point3d): (Optional) the point to face in perspective mode
+        cullView (bool): defers entourages outside the active view and
+            lowers the detail of distant ones
+        resolve (bool): nudges or drops entourages that overlap
+        spread (float): (Optional) the minimum distance between identical
+            images
+        weights (list of str): (Optional) the mix of images as
+            pattern:weight rules
+        mirror (str): (Optional) the mirror cache directory the frames
+            point at
+        proxy (bool): places the frames with their proxy textures
+    """
+    rules = parseRules(weights) if weights else None
+    picks = (tuple(path.AllData()), tuple(seed.AllData()),
+             tuple(weights or ()), spread, mirror)
+    with STATS.phase("assign images"):
+        if spread:
+            imgs = spreadImages(path, point, spread, seed.AllData()[0], rules)
+        elif rules:
+            imgs = loadWeighted(path, point, rules, seed.AllData()[0])
+        else:
+            imgs = loadImage(path, point, seed)
+    if mirror:
+        imgs = TreeHandler.fromFlat(mirrorFiles(imgs.AllData(), mirror), imgs)
+    dropped = None
+    if resolve:
+        with STATS.phase("resolve overlaps"):
+            point, dropped = resolveEntourages(imgs, point, imgHeight,
+                                               seed.AllData()[0])
+    if (data.store is not None and not data.merged and
+        data.deferred is None and not cullView and
+        layerName == data.layerName and
+        bool(perspective) == (data.billboard is not None) and
+        target == data.target):
+        with STATS.phase("reload"):
+            reloadChanged(imgs, point, imgHeight, data, dropped, picks)
+        return
+    data.clear()
+    warmTextures(imgs.AllData())
+    with STATS.enter("clear layer", NewLayerContext(layerName)):
+        cameraDirection = getCameraDirection()
+        billboard = None
+        orientation = cameraDirection
+        if perspective:
+            anchors = point.AllData()
+            billboard = BillboardCache([p.X for p in anchors],
+                                       [p.Y for p in anchors])
+            orientation = billboardOrientation(point, billboard,
+                                               getEye(target))
+        lod = PROXY_LOD if proxy else 0
+        deferred = None
+        columns, shape = TreeHandler.match(imgs, point, imgHeight)
+        if dropped is not None:
+            lod = TreeHandler.fromFlat([DROPPED if d else lod for d in dropped],
+                                       shape)
+        if cullView:
+            with STATS.phase("cull"):
+                levels = cullEntourages(entourageBounds(*columns))
+            if dropped is not None:
+                levels = [DROPPED if d else lv
+                          for lv, d in zip(levels, dropped)]
+            levels = frameLevels(levels, proxy)
+            lod = TreeHandler.fromFlat(levels, shape)
+            visible, culled, perLevel = lodCounts(levels)
+            print("Visible: {}, culled: {}, per LOD: {}".format(
+                visible, culled, perLevel))
+            deferred = [i for i, lv in enumerate(levels) if lv == CULLED]
+            STATS.count("deferred", len(deferred))
+        with STATS.phase("place images"):
+            pfIds = placeImage(imgs, point, orientation, imgHeight, lod)
+        STATS.count("entourages", sum(1 for guid in pfIds.AllData()
+                                      if guid is not None))
+        data.cache(cameraDir=cameraDirection, billboard=billboard,
+                   target=target, deferred=deferred, layerName=layerName,
+                   proxy=proxy)
+        data.picks = picks
+        data.store = EntourageStore(TreeHandler.itemKeys(shape),
+                                    pfIds.AllData(),
+                                    [(p.X, p.Y, p.Z) for p in columns[1]],
+                                    columns[0], columns[2])
+        updateYaws(data, data.store)
+    reportTextures(imgs.AllData(), proxy)
+
+def storeEntries(store):
+    """Returns key -> (guid, path, point, height) of the placed
+    entourages of a store, the way reloadChanged compares them"""
+    keys = store.keys()
+    return dict((keys[i], (guid, store.image(i),
+                           rg.Point3d(*store.anchor(i)), store.heights[i]))
+                for i, guid in enumerate(store.guids) if guid is not None)
+
+def updateYaws(data, store):
+    """Sets the yaws of the store to the current billboard or camera"""
+    if data.billboard is not None and data.billboard.yaws is not None:
+        store.setYaws(data.billboard.yaws)
+    elif data.cameraDir is not None:
+        heading = math.degrees(math.atan2(data.cameraDir.Y, data.cameraDir.X))
+        store.setYaws([heading]*len(store))
+
+def reloadChanged(imgs, point, imgHeight, data, dropped=None, picks=None):
+    """Updates the loaded entourages to a new assignment in place
+
+    Only entourages whose image, height or anchor changed are touched:
+    new ones are added, removed ones deleted, and moved ones transformed.
+    Entourages are keyed by their path and index in the matched tree, and
+    the ones that only shifted to another key are kept as they are.
+    Moved entourages keep their image as long as the images are picked
+    with the same inputs, also once their key shifts. Every entourage keeps its yaw in the store, so
+    one turned by a partial orient is not assumed to face the camera.
+
+    Args:
+        imgs (gh.DataTree): paths to the .png images
+        point (gh.DataTree): the anchor points
+        imgHeight (gh.DataTree): the target heights
+        data (Struct): the current state of the entourages
+        dropped (list of bool): (Optional) entourages left out by the
+            overlap resolver
+        picks (tuple): (Optional) the inputs the images were picked with
+    """
+    columns, shape = TreeHandler.match(imgs, point, imgHeight)
+    keys = TreeHandler.itemKeys(shape)
+    new = dict(zip(keys, zip(*columns)))
+    if dropped is not None:
+        for key, d in zip(keys, dropped):
+            if d:
+                del new[key]
+    entries = storeEntries(data.store)
+    if picks is not None and picks == data.picks:
+        new = keepShifted(entries, new)
+    entries, stale = rekeyEntries(entries, new)
+    if picks is not None and picks == data.picks:
+        new = keepImages(entries, new)
+    added, moved, removed = diffEntries(entries, new)
+    warmTextures([new[key][0] for key in added])
+    itemYaws = dict((g, y) for g, y in zip(data.store.guids, data.store.yaws)
+                    if g is not None) # as turned, maybe by a partial orient
+    heading = 0.0
+    if data.cameraDir is not None:
+        heading = math.degrees(math.atan2(data.cameraDir.Y, data.cameraDir.X))
+    billboard = data.billboard
+    if billboard is not None:
+        anchors = point.AllData()
+        billboard = BillboardCache([p.X for p in anchors],
+                                   [p.Y for p in anchors])
+        yaws = dict(zip(keys, billboard.yawsFor(data.billboard.eye)))
+
+    with RhinoDocContext():
+        rs.EnableRedraw(False)
+        for guid in ([entries.pop(key)[0] for key in removed] +
+                     [entry[0] for entry in stale]):
+            if guid is not None:
+                sc.doc.Objects.Delete(guid, True)
+        for key in moved:
+            guid, path, anchor, height = entries[key]
+            moveTo = new[key][1]
+            if guid is not None:
+                yaw = itemYaws.pop(guid)
+                guid = rs.MoveObject(guid, moveTo - anchor)
+                if billboard is not None:
+                    turn = yawDeltas([yaw], [yaws[key]])[0]
+                    guid = rs.RotateObject(guid, moveTo, turn)
+                    yaw = yaws[key]
+                itemYaws[guid] = yaw
+            entries[key] = (guid, path, moveTo, height)
+        with LayerContext(data.layerName):
+            for key in added:
+                path, anchor, height = new[key]
+                orientation, yaw = data.cameraDir, heading
+                if billboard is not None:
+                    yaw = yaws[key]
+                    orientation = rg.Vector3d(*yawVectors([yaw])[0])
+                guid = placeImage.func(path, anchor, orientation, height,
+                                       PROXY_LOD if data.proxy else 0)
+                itemYaws[guid] = yaw
+                entries[key] = (guid, path, anchor, height)
+        rs.EnableRedraw(True)
+    data.picks = picks
+    data.cache(billboard=billboard)
+    items = [entries.get(key) or (None,) + new.get(key, matched)
+             for key, matched in zip(keys, zip(*columns))]
+    data.store = EntourageStore(keys, [item[0] for item in items],
+                                [(p.X, p.Y, p.Z) for _, _, p, _ in items],
+                                [item[1] for item in items],
+                                [item[3] for item in items])
+    data.store.setYaws([itemYaws.get(item[0], heading) for item in items])
+    STATS.count("added", len(added))
+    STATS.count("moved", len(moved))
+    STATS.count("deleted", len(removed) + len(stale))
+    print("Added: {}, moved: {}, deleted: {}".format(
+        len(added), len(moved), len(removed) + len(stale)))
+
+def applyPlan(plan, layerName, data, mirror=None, proxy=False, merge=False):
+    """Places the entourages of a placement plan in bulk and caches the
+    current state
+
+    Args:
+        plan (dict): the columns made by planner.planPlacements
+        layerName (str): the layer of the entourages
+        data (Struct): the current state of the entourages
+        mirror (str): (Optional) the mirror cache directory the frames
+            point at
+        proxy (bool): places the frames with their proxy textures
+        merge (bool): places one mesh per image instead of picture frames
+    """
+    if mirror:
+        plan["files"] = mirrorFiles(plan["files"], mirror)
+    textures = proxyTextures(plan["files"], proxy)
+    data.clear()
+    with STATS.enter("clear layer", NewLayerContext(layerName)):
+        with RhinoDocContext():
+            rs.EnableRedraw(False)
+            slots = None
+            with STATS.phase("place images"):
+                if merge:
+                    guids, slots = placeMerged(plan, textures)
+                else:
+                    guids = placePlanItems(plan, range(len(plan["image"])),
+                                           textures)
+            rs.EnableRedraw(True)
+    STATS.count("entourages", len(guids))
+    cachePlan(plan, guids, layerName, data, slots)
+    data.proxy = proxy
+    data.merged = merge
+    reportTextures(plan["files"], proxy)
+
+def proxyTextures(files, proxy):
+    """Returns the texture of every file in a mode"""
+    if not proxy:
+        return files
+    return [lodTexture(f, PROXY_LOD) for f in files]
+
+def placePlanItems(plan, indices, textures=None):
+    """Adds the picture frames of some items of a plan, return objectIDs
+
+    Args:
+        plan (dict): the columns made by planner.planPlacements
+        indices (list of int): the items to place
+        textures (list of str): (Optional) the texture of every file of
+            the plan, defaults to the files
+    """
+    files, origin, xAxis = plan["files"], plan["origin"], plan["xAxis"]
+    files = textures or files
+    images, widths, heights = plan["image"], plan["width"], plan["height"]
+    yAxis = rg.Vector3d(*UNIT_Z)
+    objects = sc.doc.Objects
+    guids = []
+    for i in indices:
+        plane = rg.Plane(rg.Point3d(*origin[3*i:3*i+3]),
+                         rg.Vector3d(xAxis[2*i], xAxis[2*i+1], 0), yAxis)
+        guids.append(objects.AddPictureFrame(
+            plane, files[images[i]], False, widths[i], heights[i],
+            False, False))
+    return guids
+
+def placeMerged(plan, textures):
+    """Adds one textured mesh per image holding the quads of all its
+    items, return the objectID and the quad of every item
+
+    Args:
+        plan (dict): the columns made by planner.planPlacements
+        textures (list of str): the texture of every file of the plan
+    Returns:
+        (guids, slots) where the slot of an item is the index of its quad
+        in the mesh, fixed for the life of the mesh
+    """
+    guids = [None]*len(plan["image"])
+    slots = [0]*len(plan["image"])
+    objects, materials = sc.doc.Objects, sc.doc.Materials
+    meshes = 0
+    for image, indices in enumerate(groupByImage(plan)):
+        if not indices:
+            continue
+        meshes += 1
+        index = materials.Add()
+        material = materials[index]
+        material.SetBitmapTexture(textures[image])
+        material.SetTransparencyTexture(textures[image])
+        materials.Modify(material, index, True)
+        attributes = sc.doc.CreateDefaultAttributes()
+        attributes.MaterialIndex = index
+        attributes.MaterialSource = (
+            Rhino.DocObjects.ObjectMaterialSource.MaterialFromObject)
+        guid = objects.AddMesh(
+            quadMesh(quadVertices(plan, indices), len(indices)), attributes)
+        for slot, i in enumerate(indices):
+            guids[i] = guid
+            slots[i] = slot
+    STATS.count("meshes", meshes)
+    return guids, slots
+
+def rewriteQuads(data, indices):
+    """Moves the quads of some entourages of merged meshes to the current
+    yaws of data.store, rewriting only their vertices
+
+    Args:
+        data (Struct): the current state of the entourages
+        indices (list of int): the entourages to rewrite
+    """
+    store = data.store
+    heights = [store.heights[i] for i in indices]
+    columns = {"anchor": [c for i in indices for c in store.anchor(i)],
+               "width": scaleImages([store.image(i) for i in indices],
+                                    heights),
+               "height": heights}
+    facePlan(columns, yaws=[store.yaws[i] for i in indices])
+    vertices = quadVertices(columns, range(len(indices)))
+    slots = store.slots
+    meshes = {}
+    for k, i in enumerate(indices):
+        meshes.setdefault(store.guids[i], []).append((k, slots[i]))
+    for guid, quads in meshes.items():
+        obj = sc.doc.Objects.FindId(guid)
+        if obj is None:
+            continue
+        mesh = obj.MeshGeometry.DuplicateMesh()
+        for k, slot in quads:
+            for corner in range(4):
+                v = 12*k + 3*corner
+                mesh.Vertices.SetVertex(4*slot + corner, vertices[v],
+                                        vertices[v+1], vertices[v+2])
+        sc.doc.Objects.Replace(guid, mesh)
+    STATS.count("meshes rewritten", len(meshes))
+
+def cachePlan(plan, guids, layerName, data, slots=None):
+    """Caches the state of the placed entourages of a plan
+
+    Args:
+        plan (dict): the columns made by planner.planPlacements
+        guids (list): the object id of every item of the plan
+        layerName (str): the layer of the entourages
+        data (Struct): the state to replace
+        slots (list of int): (Optional) the quad of every item in its
+            merged mesh
     """
-    with NewLayerContext(layerName):
+    files = plan["files"]
+    xyz = plan["anchor"]
+    keys, columns = denseColumns( # resolved plans leave out items
+        [tuple(key) for key in plan["keys"]],
+        (guids, [xyz[i:i+3] for i in range(0, len(xyz), 3)],
+         [files[image] for image in plan["image"]], plan["height"],
+         plan["yaw"], slots or [0]*len(guids)),
+        (None, (0.0, 0.0, 0.0), None, 0.0, 0.0, 0))
+    store = EntourageStore(keys, *columns[:4],
+                           slots=None if slots is None else columns[5])
+    store.setYaws(columns[4])
+    billboard = None
+    if plan["eye"] is not None:
+        billboard = BillboardCache(store.anchors[0::3], store.anchors[1::3])
+        billboard.yawsFor(plan["eye"])
         cameraDirection = getCameraDirection()
-        num = TreeHandler.treeTopology(point)
-        imgs = loadImage(path, num, seed)
-        pfIds = placeImage(imgs, point, cameraDirection, imgHeight)
-        data.cache(pictureframeIds=pfIds, point=point,
-                   cameraDir=cameraDirection)
+    else:
+        cameraDirection = rg.Vector3d(plan["direction"][0],
+                                      plan["direction"][1], 0)
+        cameraDirection.Unitize()
+    data.clear()
+    data.cache(cameraDir=cameraDirection, billboard=billboard,
+               layerName=layerName, store=store)
+
+def populateInBackground(path, imgHeight, point, layerName, seed, data,
+                         perspective=False, target=None, message=None,
+                         mirror=None, proxy=False, weights=None, spread=None,
+                         resolve=False):
+    """Plans the entourages on a worker thread and places them in chunks
+    while Rhino stays responsive
+
+    The loaded entourages are only replaced once all new ones are placed,
+    so a cancelled or failed job just deletes what it placed.
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        imgHeight (gh.DataTree): the target heights
+        point (gh.DataTree): the anchor points
+        layerName (str): the layer of the entourages
+        seed (gh.DataTree): the random seed for loadImage
+        data (Struct): the current state of the entourages
+        perspective (bool): turns each entourage toward the camera location
+        target (rg.Point3d): (Optional) the point to face in perspective mode
+        message (callable): (Optional) shows the progress
+        mirror (str): (Optional) the mirror cache directory the frames
+            point at
+        proxy (bool): places the frames with their proxy textures
+        weights (list of str): (Optional) the mix of images as
+            pattern:weight rules
+        spread (float): (Optional) the minimum distance between identical
+            images
+        resolve (bool): leaves out entourages that overlap
+    Returns:
+        the started BackgroundJob
+    """
+    message = message or (lambda text: None)
+    columns, shape = TreeHandler.match(path, point, imgHeight)
+    keys = TreeHandler.itemKeys(shape)
+    seed = seed.AllData()[0]
+    with RhinoDocContext():
+        direction = getCameraDirection()
+        eye = getEye(target) if perspective else None
+    planned = {}
+    textures = []
+    guids = []
+
+    def plan():
+        planned.update(planEntourages(columns, keys, seed, direction, eye,
+                                      mirror, weights, spread, resolve))
+        textures.extend(proxyTextures(planned["files"], proxy))
+        return list(range(len(planned["image"])))
+
+    def commit(chunk):
+        with LayerContext(layerName):
+            with RhinoDocContext():
+                guids.extend(placePlanItems(planned, chunk, textures))
+                sc.doc.Views.Redraw()
+
+    def progress(done, total):
+        if total is None:
+            message("Planning...")
+        else:
+            message("Placed {}/{}".format(done, total))
+
+    def finish():
+        with RhinoDocContext():
+            if data.store is not None:
+                old = [g for g in data.store.guids if g is not None]
+                if old:
+                    sc.doc.Objects.Delete(old, True)
+        cachePlan(planned, guids, layerName, data)
+        data.proxy = proxy
+        saveState(data)
+        message(None)
+        print("Placed {} entourages".format(len(guids)))
+
+    def rollback(error):
+        with RhinoDocContext():
+            if guids:
+                sc.doc.Objects.Delete(guids, True)
+            sc.doc.Views.Redraw()
+        message("Cancelled" if error is None else "Failed")
+        if error is not None:
+            print("Failed to populate: {}".format(error))
+
+    job = BackgroundJob(plan, commit, CHUNK_SIZE, progress, finish, rollback)
+    job.start()
+    return job
+
+def planEntourages(columns, keys, seed, direction, eye=None, mirror=None,
+                   weights=None, spread=None, resolve=False):
+    """Returns the placement plan of the matched inputs
+
+    Images are picked and overlaps resolved like in populate. Only reads
+    the images, so it can run on a worker thread.
+
+    Args:
+        columns (list): the matched image directories, anchor points and
+            target heights
+        keys (list of (str, int)): the tree key of every anchor
+        seed (int): the random seed for loadImage
+        direction (rg.Vector3d): the camera direction
+        eye (rg.Point3d): (Optional) the point to face in perspective mode
+        mirror (str): (Optional) the mirror cache directory the plan
+            points at
+        weights (list of str): (Optional) the mix of images as
+            pattern:weight rules
+        spread (float): (Optional) the minimum distance between identical
+            images
+        resolve (bool): nudges entourages that overlap and leaves out the
+            ones that cannot be
+    """
+    folders, anchors, heights = columns
+    rules = parseRules(weights) if weights else None
+    if spread:
+        imgs = spreadPicks(folders, anchors, spread, seed, rules)
+    elif rules:
+        imgs = weightedImages(folders, anchors, rules, seed)
+    else:
+        imgs = [loadImage.func(folder, p, seed)
+                for folder, p in zip(folders, anchors)]
+    xyz = [(p.X, p.Y, p.Z) for p in anchors]
+    if resolve:
+        xs, ys, dropped = resolveOverlaps([a[0] for a in xyz],
+                                          [a[1] for a in xyz],
+                                          scaleImages(imgs, heights), seed)
+        kept = [i for i, d in enumerate(dropped) if not d]
+        imgs, heights, keys = ([imgs[i] for i in kept],
+                               [heights[i] for i in kept],
+                               [keys[i] for i in kept])
+        xyz = [(xs[i], ys[i], xyz[i][2]) for i in kept]
+    files, images = internPaths(imgs)
+    if mirror:
+        cache = MirrorCache(mirror)
+        local = cache.fetchAll(files)
+        if cache.misses:
+            cache.trim(local.values())
+        files = [local[f] for f in files]
+    else:
+        prewarm(files)
+    return layoutPlan(xyz, files, images, [imageSize(f) for f in files],
+                      heights, (direction.X, direction.Y),
+                      eye and (eye.X, eye.Y), keys)
+
+def previewEntourages(path, imgHeight, point, seed, conduit,
+                      perspective=False, target=None, mirror=None,
+                      proxy=False, weights=None, spread=None, resolve=False):
+    """Plans the entourages and draws them through the conduit, leaving
+    the document untouched
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        imgHeight (gh.DataTree): the target heights
+        point (gh.DataTree): the anchor points
+        seed (gh.DataTree): the random seed for loadImage
+        conduit (PreviewConduit): draws the entourages
+        perspective (bool): turns each entourage toward the camera location
+        target (rg.Point3d): (Optional) the point to face in perspective mode
+        mirror (str): (Optional) the mirror cache directory the plan
+            points at
+        proxy (bool): draws the proxy textures
+        weights (list of str): (Optional) the mix of images as
+            pattern:weight rules
+        spread (float): (Optional) the minimum distance between identical
+            images
+        resolve (bool): leaves out entourages that overlap
+    """
+    showPreview(conduit, planInputs(path, imgHeight, point, seed,
+                                    perspective, target, mirror, weights,
+                                    spread, resolve), proxy)
+
+def planInputs(path, imgHeight, point, seed, perspective=False, target=None,
+               mirror=None, weights=None, spread=None, resolve=False):
+    """Returns the placement plan of the inputs facing the current camera
+
+    Args:
+        path (gh.DataTree): paths to the image directories
+        imgHeight (gh.DataTree): the target heights
+        point (gh.DataTree): the anchor points
+        seed (gh.DataTree): the random seed for loadImage
+        perspective (bool): turns each entourage toward the camera location
+        target (rg.Point3d): (Optional) the point to face in perspective mode
+        mirror (str): (Optional) the mirror cache directory the plan
+            points at
+        weights (list of str): (Optional) the mix of images as
+            pattern:weight rules
+        spread (float): (Optional) the minimum distance between identical
+            images
+        resolve (bool): leaves out entourages that overlap
+    """
+    columns, shape = TreeHandler.match(path, point, imgHeight)
+    with RhinoDocContext():
+        direction = getCameraDirection()
+        eye = getEye(target) if perspective else None
+    with STATS.phase("plan"):
+        return planEntourages(columns, TreeHandler.itemKeys(shape),
+                              seed.AllData()[0], direction, eye, mirror,
+                              weights, spread, resolve)
+
+def showPreview(conduit, plan, proxy=False):
+    """Draws the items of a plan through the conduit
+
+    Args:
+        conduit (PreviewConduit): draws the entourages
+        plan (dict): the columns made by planner.planPlacements
+        proxy (bool): draws the proxy textures
+    """
+    with STATS.phase("preview"):
+        textures = dict(zip(plan["files"],
+                            proxyTextures(plan["files"], proxy)))
+        groups = [(textures[f], vertices, count)
+                  for f, vertices, count in previewGroups(plan)]
+        conduit.show(groups, quadBounds(groups), plan)
+    STATS.count("previewed", len(plan["image"]))
+    print("Previewing {} entourages".format(len(plan["image"])))
+
+def turnPreview(conduit, proxy=False, target=None,
+                threshold=FOLLOW_THRESHOLD):
+    """Turns the previewed entourages toward the camera
+
+    Args:
+        conduit (PreviewConduit): draws the entourages
+        proxy (bool): draws the proxy textures
+        target (rg.Point3d): (Optional) the point to face in perspective mode
+        threshold (float): the minimum angle (in degrees) the camera has
+            to turn in parallel views
+    """
+    plan = conduit.plan
+    with RhinoDocContext():
+        direction = getCameraDirection()
+        eye = getEye(target) if plan["eye"] is not None else None
+    if eye is None:
+        planned = rg.Vector3d(plan["direction"][0], plan["direction"][1], 0)
+        if abs(orientAngle(planned, direction)) <= threshold:
+            return
+    facePlan(plan, (direction.X, direction.Y), eye and (eye.X, eye.Y))
+    showPreview(conduit, plan, proxy)
+
+def stateColumns(data):
+    """Returns the placed entourages as the columns of a placement plan
+
+    Args:
+        data (Struct): the current state of the entourages
+    """
+    store = data.store
+    placed = [i for i, guid in enumerate(store.guids)
+              if guid is not None and store.image(i) is not None]
+    paths = [store.image(i) for i in placed]
+    heights = [store.heights[i] for i in placed]
+    files, images = internPaths(paths)
+    columns = {"files": files, "image": images,
+               "anchor": [c for i in placed for c in store.anchor(i)],
+               "width": scaleImages(paths, heights), "height": heights}
+    return facePlan(columns, yaws=[store.yaws[i] for i in placed])
 
 def orientImages(data):
     """(Re)orients existing entourages to a new camera angle and
@@ -183,19 +1376,258 @@ def orientImages(data):
 
     Args:
         data: the cache data of entourages
+    Notes:
+        Walks the flat arrays of data.store rather than the trees
     """
-    @TreeHandler
-    def rotate(guid, center, angle):
-        rs.RotateObject(guid, center, angle)
+    with RhinoDocContext():
+        rs.EnableRedraw(False)
+        turnEntourages(data, range(len(data.store)))
+        data.cache(cameraDir=getCameraDirection())
+        updateYaws(data, data.store)
+        with STATS.phase("place deferred"):
+            placeDeferred(data)
+        rs.EnableRedraw(True)
+    saveView(data)
+
+def targetYaws(data):
+    """Returns the yaw (in degrees) every entourage faces the current
+    camera or target with"""
+    if data.billboard is not None:
+        eye = getEye(data.target)
+        return data.billboard.yawsFor((eye.X, eye.Y))
+    direction = getCameraDirection()
+    return [math.degrees(math.atan2(direction.Y, direction.X))]*len(data.store)
+
+def turnEntourages(data, indices):
+    """Turns some placed entourages from their yaw in data.store to the
+    current camera or target
+
+    Picture frames are rotated about their anchors, and the quads of
+    merged meshes are rewritten. Entourages already facing the camera are
+    left alone.
+
+    Args:
+        data (Struct): the current state of the entourages
+        indices (list of int): the entourages to turn
+    """
+    store = data.store
+    targets = targetYaws(data)
+    angles = yawDeltas([store.yaws[i] for i in indices],
+                       [targets[i] for i in indices])
+    turned = [(i, a) for i, a in zip(indices, angles)
+              if store.guids[i] is not None and abs(a) > YAW_TOLERANCE]
+    for i, _ in turned:
+        store.yaws[i] = targets[i]
+    with STATS.phase("rotate"):
+        if data.merged:
+            rewriteQuads(data, [i for i, _ in turned])
+        else:
+            zAxis = rg.Vector3d(*UNIT_Z)
+            xyz = store.anchors
+            for i, a in turned:
+                center = rg.Point3d(xyz[3*i], xyz[3*i+1], xyz[3*i+2])
+                sc.doc.Objects.Transform(
+                    store.guids[i],
+                    rg.Transform.Rotation(math.radians(a), zAxis, center),
+                    True)
+    STATS.count("rotated", len(turned))
+
+def queryEntourages(data, shapes, radius=None):
+    """Returns the indices of the placed entourages matching any shape
+
+    Points select the entourages within radius of them, or the nearest
+    one if there is no radius. Boxes select the entourages inside them,
+    and closed curves or meshes the ones inside their outline, all on
+    the XY plane.
+
+    Args:
+        data (Struct): the current state of the entourages
+        shapes (list): rg.Point3d, rg.Box, rg.BoundingBox, closed planar
+            rg.Curve or rg.Mesh
+        radius (float): (Optional) the search radius around points
+    """
+    index = data.store.spatialIndex()
+    found = set()
+    for shape in shapes:
+        if isinstance(shape, rg.Point3d):
+            if radius:
+                found.update(index.radius(shape.X, shape.Y, radius))
+            else:
+                nearest = index.nearest(shape.X, shape.Y)
+                if nearest is not None:
+                    found.add(nearest)
+        elif isinstance(shape, (rg.Box, rg.BoundingBox)):
+            box = shape.BoundingBox if isinstance(shape, rg.Box) else shape
+            found.update(index.box(box.Min.X, box.Min.Y,
+                                   box.Max.X, box.Max.Y))
+        else:
+            found.update(index.polygon(regionLoops(shape)))
+    return sorted(found)
+
+def deleteEntourages(data, indices):
+    """Deletes some placed entourages in bulk and caches the new state
+
+    Picture frames are deleted together. The quads of merged meshes are
+    collapsed onto their anchors, and meshes left with no quads are
+    deleted.
 
+    Args:
+        data (Struct): the current state of the entourages
+        indices (list of int): the entourages to delete
+    """
+    store = data.store
+    indices = [i for i in indices if store.guids[i] is not None]
     with RhinoDocContext():
         rs.EnableRedraw(False)
-        angle = orientAngle(data.cameraDir, getCameraDirection())
-        rotate(data.pictureframeIds, data.point, angle)
+        if data.merged:
+            collapseQuads(data, indices)
+        else:
+            sc.doc.Objects.Delete([store.guids[i] for i in indices], True)
         rs.EnableRedraw(True)
-        data.cache(cameraDir=getCameraDirection())
+    store.replaceGuids(indices, [None]*len(indices))
+    STATS.count("deleted", len(indices))
+    print("Deleted: {}".format(len(indices)))
+
+def collapseQuads(data, indices):
+    """Collapses the quads of some entourages of merged meshes onto their
+    anchors, deleting meshes left with no quads"""
+    store = data.store
+    slots = store.slots
+    quads = {}
+    for i in indices:
+        quads.setdefault(store.guids[i], []).append(i)
+    left = collections.Counter(g for g in store.guids if g is not None)
+    for guid, items in quads.items():
+        if len(items) == left[guid]:
+            sc.doc.Objects.Delete(guid, True)
+            continue
+        obj = sc.doc.Objects.FindId(guid)
+        if obj is None:
+            continue
+        mesh = obj.MeshGeometry.DuplicateMesh()
+        for i in items:
+            x, y, z = store.anchor(i)
+            for corner in range(4):
+                mesh.Vertices.SetVertex(4*slots[i] + corner, x, y, z)
+        sc.doc.Objects.Replace(guid, mesh)
     
 
+def saveState(data):
+    """Saves the loaded entourages to the document strings, so that they
+    can be oriented after the document is reopened
+
+    Args:
+        data (Struct): the current state of the entourages
+    """
+    store = data.store
+    state = {"layerName": data.layerName, "keys": store.keys(),
+             "merged": bool(data.merged), "culled": data.deferred is not None,
+             "guids": [str(g) if g is not None else "" for g in store.guids],
+             "anchors": list(store.anchors), "paths": store.paths,
+             "images": list(store.images), "heights": list(store.heights)}
+    if store.slots is not None:
+        state["slots"] = list(store.slots)
+    with RhinoDocContext():
+        sc.doc.Strings.SetString(STATE_SECTION,
+                                 stateEntries(data.layerName)[0],
+                                 packState(state))
+    saveView(data)
+
+def stateEntries(layerName):
+    """Returns the document string entries of the entourages and the view
+    of a layer, so that components loading other layers keep their own"""
+    return tuple("{}:{}".format(entry, layerName) for entry in STATE_ENTRIES)
+
+def saveView(data):
+    """Saves the view the entourages are oriented to
+
+    Kept apart from saveState, so that orienting does not rewrite the
+    entourages.
+    """
+    view = {"cameraDir": None, "target": None, "eye": None,
+            "proxy": bool(data.proxy)}
+    if data.store is not None:
+        view["yaws"] = list(data.store.yaws)
+    if data.cameraDir is not None:
+        view["cameraDir"] = [data.cameraDir.X, data.cameraDir.Y,
+                             data.cameraDir.Z]
+    if data.target is not None:
+        view["target"] = [data.target.X, data.target.Y, data.target.Z]
+    if data.billboard is not None:
+        view["eye"] = data.billboard.eye
+    with RhinoDocContext():
+        sc.doc.Strings.SetString(STATE_SECTION,
+                                 stateEntries(data.layerName)[1],
+                                 packState(view))
+
+def restoreState(layerName):
+    """Returns the entourages of a layer saved in the document, or None
+    if there are none left
+
+    Entourages whose objects no longer exist are left out. States saved
+    before they were kept per layer are used if their layer matches.
+
+    Args:
+        layerName (str): the layer of the entourages
+    """
+    with RhinoDocContext():
+        strings = sc.doc.Strings
+        state, view = [unpackState(strings.GetValue(STATE_SECTION, entry))
+                       for entry in stateEntries(layerName)]
+        if state is None:
+            state, view = [unpackState(strings.GetValue(STATE_SECTION, entry))
+                           for entry in STATE_ENTRIES]
+        if (state is None or view is None or
+            state["layerName"] != layerName):
+            return None
+        guids = [System.Guid(g) if g else None for g in state["guids"]]
+        guids = [g if g is not None and sc.doc.Objects.FindId(g) else None
+                 for g in guids]
+    if not any(guids):
+        return None
+    xyz = state["anchors"]
+    data = Struct()
+    data.layerName = state["layerName"]
+    data.merged = state.get("merged", False)
+    if state.get("culled"):
+        data.deferred = [] # culled ones are not saved, so no reload
+    paths = None
+    if "paths" in state:
+        paths = [state["paths"][i] for i in state["images"]]
+    slots = state.get("slots")
+    if data.merged and slots is None: # an older state, counted instead
+        slots = meshSlots(guids)
+    data.store = EntourageStore([tuple(key) for key in state["keys"]], guids,
+                                [xyz[i:i+3] for i in range(0, len(xyz), 3)],
+                                paths, state.get("heights"), slots)
+    if view["cameraDir"] is not None:
+        data.cameraDir = rg.Vector3d(*view["cameraDir"])
+    if view["target"] is not None:
+        data.target = rg.Point3d(*view["target"])
+    data.proxy = view.get("proxy", False)
+    if view["eye"] is not None:
+        data.billboard = BillboardCache(xyz[0::3], xyz[1::3])
+        data.billboard.yawsFor(view["eye"])
+    if len(view.get("yaws", ())) == len(data.store):
+        data.store.setYaws(view["yaws"])
+    else:
+        updateYaws(data, data.store)
+    return data
+
+def followCamera(data, threshold=FOLLOW_THRESHOLD):
+    """Reorients entourages if the camera has turned more than threshold
+
+    Args:
+        data: the cache data of entourages
+        threshold (float): the minimum angle (in degrees) to reorient
+    """
+    if data.cameraDir is None:
+        return
+    if data.billboard is not None or data.deferred:
+        orientImages(data)
+    elif abs(orientAngle(data.cameraDir, getCameraDirection())) > threshold:
+        orientImages(data)
+
 def orientAngle(v1, v2):
     """Returns the signed angle for orienting v1 to v2
 
@@ -209,11 +1641,29 @@ def orientAngle(v1, v2):
     direction = sign(rg.Vector3d.Multiply(cross, rg.Vector3d(*UNIT_Z)))
     return direction * math.degrees(angle)
 
+def setMessage(text):
+    """Shows text under the component"""
+    ghenv.Component.Message = text
+    ghenv.Component.OnDisplayExpired(True)
+
+def followView():
+    """Keeps the previewed and the loaded entourages facing the camera"""
+    if conduit.plan is not None:
+        turnPreview(conduit, bool(proxy), target)
+    if isLoaded():
+        followCamera(data)
+
+def isLoaded():
+    """Returns whether entourages are loaded, which a first background
+    load only makes true once it finishes"""
+    return "data" in globals() and data.store is not None
+
 def validInput():
     if (not path.AllData() or
         not imgHeight.AllData() or
         not point.AllData() or
-        len(layerName.AllData()) > 1):
+        len(layerName.AllData()) > 1 or
+        getErrorMessage()):
         return False
     return True
     
@@ -221,12 +1671,16 @@ def getWarningMessage():
     """Returns warning messages or None if no warnings found
     """
     message = None
+    if cull and (plan or background or preview or merge):
+        return "cull only applies to picture frames loaded in the foreground"
+    if plan:
+        return message
     if not path.AllData():
         message = "Path to PNGs is missing"
     elif not imgHeight.AllData():
         message = "imgHeight is missing"
-    elif not point.AllData():
-        message = "At least one point is needed"
+    elif not point.AllData() and not region.AllData():
+        message = "At least one point or region is needed"
     return message
 
 def getErrorMessage():
@@ -235,6 +1689,16 @@ def getErrorMessage():
     message = None
     if len(layerName.AllData()) > 1:
         message = "Multiple layer names not supported"
+    elif weights:
+        try:
+            rules = parseRules(weights)
+        except ValueError as e:
+            return str(e)
+        for folder in set(path.AllData()):
+            if (os.path.isdir(folder) and
+                not any(weightedLibrary(folder, rules)[1])):
+                message = "No image in {} matches the weights".format(folder)
+                break
     return message
 
 if layerName.BranchCount == 0: 
@@ -243,12 +1707,156 @@ if layerName.BranchCount == 0:
 if seed.BranchCount == 0:
     seed.Add(RANDOM_SEED)
 
-if load and validInput():
-    data = Struct()
-    populate(path, imgHeight, point, layerName.AllData()[0], seed, data)
+STATS.reset()
+planCache = TreeHandler.cacheInfo()
+
+if load:
+    IMAGE_SIZES.clear()
+    FILE_LISTS.clear()
+
+if load and region.AllData() and path.AllData() and imgHeight.AllData():
+    with STATS.phase("populate region"):
+        point = populateRegion(region, regionSpacing(path, imgHeight), seed)
+
+if load and not plan and getErrorMessage():
+    print(getErrorMessage())
+elif load and getWarningMessage():
+    print(getWarningMessage())
+
+try:
+    job
+except NameError:
+    job = None
+
+if cancel and job is not None:
+    job.cancel()
+
+try:
+    conduit
+except NameError:
+    conduit = PreviewConduit()
+
+if load and preview and plan:
+    showPreview(conduit, loadPlan(plan), bool(proxy))
+elif load and preview and validInput():
+    previewEntourages(path, imgHeight, point, seed, conduit, perspective,
+                      target, mirror, bool(proxy), weights, spread, resolve)
+elif load and background and not plan and validInput():
+    if "data" not in globals():
+        data = Struct()
+    if job is not None:
+        job.cancel()
+        job.step()
+    job = populateInBackground(path, imgHeight, point,
+                               layerName.AllData()[0], seed, data,
+                               perspective, target, setMessage, mirror,
+                               bool(proxy), weights, spread, resolve)
+elif load and plan:
+    if "data" not in globals():
+        data = Struct()
+    applyPlan(loadPlan(plan), layerName.AllData()[0], data, mirror,
+              bool(proxy), bool(merge))
+    with STATS.phase("save state"):
+        saveState(data)
+elif load and merge and validInput():
+    if "data" not in globals():
+        data = Struct()
+    applyPlan(planInputs(path, imgHeight, point, seed, perspective, target,
+                         mirror, weights, spread, resolve),
+              layerName.AllData()[0], data, None, bool(proxy), True)
+    with STATS.phase("save state"):
+        saveState(data)
+elif load and validInput():
+    if "data" not in globals():
+        data = Struct()
+    populate(path, imgHeight, point, layerName.AllData()[0], seed, data,
+             perspective, target, cull, resolve, spread, weights, mirror,
+             bool(proxy))
+    with STATS.phase("save state"):
+        saveState(data)
+
+if bake and conduit.plan is not None:
+    if "data" not in globals():
+        data = Struct()
+    applyPlan(conduit.plan, layerName.AllData()[0], data, None, bool(proxy),
+              bool(merge))
+    conduit.clear()
+    with STATS.phase("save state"):
+        saveState(data)
+elif not preview and conduit.plan is not None:
+    conduit.clear()
+
+if ((orient or follow or proxy is not None or select.AllData()) and
+    "data" not in globals()):
+    restored = restoreState(layerName.AllData()[0])
+    if restored is not None:
+        data = restored
+
+if proxy is not None and isLoaded() and bool(data.proxy) != bool(proxy):
+    with STATS.phase("swap textures"):
+        swapTextures(data, bool(proxy))
+    saveView(data)
+
+selected = None
+if select.AllData() and isLoaded():
+    with STATS.phase("query"):
+        found = queryEntourages(data, select.AllData(), radius)
+    selected = [data.store.guids[i] for i in found]
+    STATS.count("selected", len(found))
+    if action == "delete":
+        with STATS.phase("delete"):
+            deleteEntourages(data, found)
+        with STATS.phase("save state"):
+            saveState(data)
+    elif action == "orient":
+        with RhinoDocContext():
+            rs.EnableRedraw(False)
+            turnEntourages(data, found)
+            rs.EnableRedraw(True)
+        saveView(data)
+elif select.AllData():
+    print("Entourages has not been loaded.")
 
 if orient:
-    try:
+    if conduit.plan is not None:
+        turnPreview(conduit, bool(proxy), target, 0)
+    if isLoaded():
         orientImages(data)
-    except NameError:
+    elif conduit.plan is None:
+        print("Entourages has not been loaded.")
+
+try:
+    follower
+except NameError:
+    follower = ViewChangeWatcher(followView, FOLLOW_INTERVAL)
+
+if follow and (isLoaded() or conduit.plan is not None):
+    follower.start()
+else:
+    follower.stop()
+
+try:
+    exported
+except NameError:
+    exported = None
+
+changed = load or orient or (action == "delete" and select.AllData())
+if export and (export != exported or changed):
+    if isLoaded():
+        with STATS.phase("export"):
+            count = exportPlan(stateColumns(data), export)
+        print("Exported {} entourages to {}".format(count, export))
+        exported = export
+    else:
         print("Entourages has not been loaded.")
+elif not export:
+    exported = None
+
+planInfo = TreeHandler.cacheInfo()
+stats = STATS.snapshot(
+    planCache={"hits": planInfo["hits"] - planCache["hits"],
+               "misses": planInfo["misses"] - planCache["misses"],
+               "size": planInfo["size"]},
+    imageSizesCached=len(IMAGE_SIZES))
+if statsLog:
+    appendLog(statsLog, stats)
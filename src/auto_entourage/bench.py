@@ -0,0 +1,565 @@
+"""Scaling benchmarks for Auto Entourage
+
+Runs outside Rhino with CPython, the component script itself against the
+simulated document of rhinosim:
+    python bench.py [suite ...] [-n 1000 10000 100000]
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import argparse
+import ast
+import contextlib
+import gc
+import io
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import rhinosim
+rhinosim.install()
+
+from rhinosim import DataTree, GH_Path, CALLS
+from ghutil import TreeHandler
+from billboard import BillboardCache, anchorYaws
+from culling import cullLevels
+from region import poissonDisk
+from spatial import AnchorIndex, resolveOverlaps, spreadAssign
+from sampling import AliasTable, CounterRandom, anchorKey
+from store import EntourageStore
+from planner import planPlacements
+from export import writeGltf, writeObj
+from prewarm import prewarm
+from mirror import MirrorCache
+from preview import previewGroups, quadBounds
+
+SIZES = (1000, 10000, 100000)
+
+def bestOf(func, repeat=3):
+    """Returns the best wall time (in seconds) of repeated calls to func"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(suite, case, n, seconds):
+    print("{:<12} {:<24} n={:<8} {:>10.2f} ms".format(
+        suite, case, n, seconds * 1000))
+
+def randomAnchors(n, seed=0, extent=1000.0):
+    """Returns seeded random x and y coordinate lists"""
+    rnd = random.Random(seed)
+    xs = [rnd.uniform(-extent, extent) for _ in range(n)]
+    ys = [rnd.uniform(-extent, extent) for _ in range(n)]
+    return xs, ys
+
+def benchBillboard(n):
+    """Per-anchor yaw: one call per anchor (as TreeHandler dispatches
+    orientAngle) against a single flat pass and a cache hit"""
+    xs, ys = randomAnchors(n)
+    eye = (0.0, -2000.0)
+    base = (1.0, 0.0)
+
+    def orientAngle(v1, v2):
+        dot = max(-1.0, min(1.0, v1[0]*v2[0] + v1[1]*v2[1]))
+        cross = v1[0]*v2[1] - v1[1]*v2[0]
+        return math.copysign(math.degrees(math.acos(dot)), cross)
+
+    def perAnchor(x, y):
+        dx, dy = x - eye[0], y - eye[1]
+        length = math.hypot(dx, dy)
+        return orientAngle(base, (dx / length, dy / length))
+
+    def loop():
+        return [perAnchor(x, y) for x, y in zip(xs, ys)]
+
+    cache = BillboardCache(xs, ys)
+    cache.yawsFor(eye)
+    report("billboard", "per-anchor loop", n, bestOf(loop))
+    report("billboard", "flat pass", n,
+           bestOf(lambda: anchorYaws(xs, ys, eye[0], eye[1])))
+    report("billboard", "cached (camera still)", n,
+           bestOf(lambda: cache.yawsFor(eye)))
+
+def perspectiveMatrix(fov=60.0, near=1.0, far=5000.0):
+    """Returns a world to clip matrix looking down +Y from the origin"""
+    f = 1 / math.tan(math.radians(fov / 2))
+    a, b = -(far + near) / (far - near), -2*far*near / (far - near)
+    return [[f, 0, 0, 0], [0, 0, f, 0], [0, -a, 0, b], [0, 1, 0, 0]]
+
+def benchCulling(n):
+    """Frustum test and level of detail over all anchors"""
+    xs, ys = randomAnchors(n)
+    zs = [0.0]*n
+    widths, heights = [0.6]*n, [1.8]*n
+    m = perspectiveMatrix()
+    report("culling", "frustum + lod", n, bestOf(
+        lambda: cullLevels(m, 1080, xs, ys, zs, widths, heights, (64, 16))))
+
+def pointTree(n, branches=100):
+    """Returns a {0;i} tree of n anchors over a number of branches
+
+    Anchors are complex numbers, which (like Point3d) are not expanded
+    into branches by th.list_to_tree.
+    """
+    xs, ys = randomAnchors(n)
+    tree = DataTree()
+    size = max(1, n // branches)
+    for i in range(0, n, size):
+        tree.AddRange([complex(x, y) for x, y in
+                       zip(xs[i:i+size], ys[i:i+size])],
+                      GH_Path(0, i // size))
+    return tree
+
+class Point(object):
+    """Stand-in for a boxed Rhino.Geometry.Point3d"""
+    __slots__ = ("X", "Y", "Z")
+    def __init__(self, x, y, z):
+        self.X, self.Y, self.Z = x, y, z
+
+def treeBytes(tree):
+    """Returns the memory of a tree of Points or GUIDs, not counting GUID
+    objects, which a store shares"""
+    size = sys.getsizeof(tree) + sys.getsizeof(tree.paths)
+    size += sys.getsizeof(tree.branches)
+    for path in tree.paths:
+        branch = tree.branches[path]
+        size += sys.getsizeof(path) + sys.getsizeof(branch)
+        for item in branch:
+            if isinstance(item, Point):
+                size += sys.getsizeof(item) + 3*sys.getsizeof(item.X)
+    return size
+
+def randomTree(rnd):
+    """Returns a small random tree, possibly with holes or empty branches"""
+    tree = DataTree()
+    depth = rnd.randint(1, 3)
+    sparse = rnd.random() < 0.2
+    def fill(track):
+        if len(track) == depth:
+            count = rnd.randint(0 if sparse else 1, 4)
+            tree.AddRange([rnd.randint(0, 9) for _ in range(count)],
+                          GH_Path(track))
+            return
+        for i in range(rnd.randint(1, 3)):
+            if not sparse or rnd.random() > 0.2:
+                fill(track + [i])
+    fill([rnd.randint(0, 1) if sparse else 0])
+    return tree
+
+def checkTreeHandler(trials=2000, seed=0):
+    """Asserts the flat engine matches the nested list matching"""
+    rnd = random.Random(seed)
+    funcs = (lambda *a: sum(a), lambda *a: a, lambda *a: [a[0]]*(a[0] % 3),
+             lambda *a: None if a[0] % 3 else a[0])
+    def call(func, args):
+        try:
+            return func(*args)
+        except Exception as e:
+            return type(e)
+    for _ in range(trials):
+        args = [rnd.choice((rnd.randint(0, 9), [1, 2, 3], randomTree(rnd)))
+                for _ in range(rnd.randint(1, 3))]
+        handler = TreeHandler(rnd.choice(funcs))
+        nested = handler._TreeHandler__callNested # reference implementation
+        expected = call(lambda *a: nested(list(map(TreeHandler.toTree, a))),
+                        args)
+        assert call(handler, args) == expected, args
+
+def benchTreeHandler(n):
+    """Matching a point tree against single values, as placeImage does"""
+    checkTreeHandler()
+    points = pointTree(n)
+    handler = TreeHandler(lambda pt, orientation, height: pt)
+    nested = handler._TreeHandler__callNested
+    report("treehandler", "nested lists", n, bestOf(
+        lambda: nested([points, TreeHandler.toTree(1j),
+                        TreeHandler.toTree(1.8)])))
+    def cold():
+        TreeHandler.planCache.clear()
+        handler(points, 1j, 1.8)
+    report("treehandler", "flat, cold plan cache", n, bestOf(cold))
+    report("treehandler", "flat, cached plan", n, bestOf(
+        lambda: handler(points, 1j, 1.8)))
+    print("plan cache: {}".format(TreeHandler.cacheInfo()))
+
+def benchRegion(n):
+    """Poisson-disk sampling of a square sized for about n anchors"""
+    side = math.sqrt(n / 0.84) # Roberts' variant packs ~0.84 per unit area
+    square = [[(0, 0), (side, 0), (side, side), (0, side)]]
+    samples = []
+    def run():
+        samples[:] = poissonDisk(square, 1.0, seed=0)
+    seconds = bestOf(run, 1)
+    report("region", "poisson disk", len(samples), seconds)
+
+def benchResolve(n):
+    """Overlap resolution of n random entourages about 1 unit wide"""
+    extent = math.sqrt(n) # about one anchor per square unit
+    xs, ys = randomAnchors(n, extent=extent / 2)
+    rnd = random.Random(1)
+    widths = [rnd.uniform(0.4, 1.0) for _ in range(n)]
+    result = []
+    def run():
+        result[:] = resolveOverlaps(xs, ys, widths, seed=0)
+    seconds = bestOf(run, 1)
+    report("resolve", "spatial hash", n, seconds)
+    print("{:<12} dropped {} of {}".format("", sum(result[2]), n))
+
+def benchSpread(n):
+    """Neighbor-aware assignment of 40 images to n anchors"""
+    extent = math.sqrt(n) # about one anchor per square unit
+    xs, ys = randomAnchors(n, extent=extent / 2)
+    libraries = [list(range(40))]*n
+    seconds = bestOf(lambda: spreadAssign(xs, ys, libraries, 3.0, seed=0), 1)
+    report("spread", "radius 3, 40 images", n, seconds)
+
+def benchSampling(n):
+    """Alias table draws of n anchors from a library of 20000 images"""
+    rnd = random.Random(0)
+    weights = [rnd.uniform(0.1, 10.0) for _ in range(20000)]
+    build = bestOf(lambda: AliasTable(weights))
+    report("sampling", "alias table build", len(weights), build)
+    table = AliasTable(weights)
+    seconds = bestOf(lambda: [table.draw(rnd) for _ in range(n)])
+    report("sampling", "alias draws", n, seconds)
+    xs, ys = randomAnchors(n)
+    def hashed():
+        return [table.draw(CounterRandom(anchorKey(0, x, y)))
+                for x, y in zip(xs, ys)]
+    report("sampling", "per-anchor hashed draws", n, bestOf(hashed))
+
+def benchStore(n):
+    """Memory and traversal of n entourages as trees and as a store, and
+    the memory the component keeps after loading them"""
+    anchors = pointTree(n)
+    points = DataTree()
+    guids = DataTree()
+    for i in range(anchors.BranchCount):
+        path = anchors.Path(i)
+        branch = anchors.Branch(i)
+        points.AddRange([Point(c.real, c.imag, 0.0) for c in branch], path)
+        guids.AddRange([uuid.uuid4() for _ in branch], path)
+    trees = treeBytes(points) + treeBytes(guids)
+    keys = TreeHandler.itemKeys(points)
+    store = EntourageStore(keys, guids.AllData(),
+                           [(p.X, p.Y, p.Z) for p in points.AllData()])
+    print("{:<12} {:<24} n={:<8} {:>10.1f} MB".format(
+        "store", "trees", n, trees / 1e6))
+    print("{:<12} {:<24} n={:<8} {:>10.1f} MB".format(
+        "store", "arrays", n, store.nbytes() / 1e6))
+    def walkTrees():
+        columns, shape = TreeHandler.match(guids, points)
+        return [(g, p.X, p.Y, p.Z) for g, p in zip(*columns)]
+    def walkStore():
+        xyz = store.anchors
+        return [(g, xyz[3*i], xyz[3*i+1], xyz[3*i+2])
+                for i, g in enumerate(store.guids)]
+    report("store", "walk trees", n, bestOf(walkTrees))
+    report("store", "walk arrays", n, bestOf(walkStore))
+    target = guids.AllData()[n // 2]
+    report("store", "lookup by guid", n, bestOf(lambda: store.find(target)))
+    with imageLibrary() as folder:
+        rhinosim.newDocument()
+        scope = componentScope(folder, list(zip(*randomAnchors(n))))
+        tracemalloc.start()
+        runComponent(scope, load=True)
+        loaded = tracemalloc.get_traced_memory()[0]
+        del scope["data"] # what this frees is held by the state alone
+        gc.collect()
+        state = loaded - tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    print("{:<12} {:<24} n={:<8} {:>10.1f} MB".format(
+        "store", "component state", n, state / 1e6))
+
+COMPONENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "auto_entourage.py")
+TREE_INPUTS = ("path", "imgHeight", "point", "layerName", "seed", "region",
+               "select") # inputs with tree access, the others are items
+
+def componentInputs():
+    """Returns the input names of the component, as listed in its
+    docstring"""
+    with open(COMPONENT) as f:
+        doc = ast.get_docstring(ast.parse(f.read()))
+    section = doc.split("Inputs:")[1].split("Output:")[0]
+    indent = re.search(r"\n( +)\w", section).group(1)
+    return re.findall(r"^{}(\w+):".format(indent), section, re.M)
+
+def itemTree(item):
+    """Returns a tree holding one item, as a connected item input"""
+    tree = DataTree()
+    tree.Add(item, GH_Path(0))
+    return tree
+
+def anchorTree(anchors):
+    """Returns a tree of points on the XY plane in one branch"""
+    tree = DataTree()
+    tree.AddRange([rhinosim.Point3d(x, y, 0) for x, y in anchors],
+                  GH_Path(0))
+    return tree
+
+def componentScope(folder, anchors, **overrides):
+    """Returns the globals of a component solve
+
+    Every input is left unconnected (an empty tree or None) except path,
+    imgHeight and point, so a new input only needs adding to the
+    component's docstring.
+
+    Args:
+        folder (str): the image folder
+        anchors (list of (float, float)): the anchor points
+        overrides: inputs to connect
+    """
+    scope = dict((name, DataTree() if name in TREE_INPUTS else None)
+                 for name in componentInputs())
+    scope.update(path=itemTree(folder), imgHeight=itemTree(1.8),
+                 point=anchorTree(anchors))
+    scope.update(overrides)
+    return scope
+
+def runComponent(scope, trace=False, **inputs):
+    """Solves the component once and returns (seconds, document calls,
+    peak traced memory in bytes or None)"""
+    scope.update(inputs)
+    CALLS.clear()
+    if trace:
+        tracemalloc.start()
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rhinosim.runScript(COMPONENT, scope)
+    seconds = time.time() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, sum(CALLS.values()), peak
+
+@contextlib.contextmanager
+def imageLibrary():
+    """Yields a temporary folder of 20 blank person images, removed
+    afterwards"""
+    folder = tempfile.mkdtemp() + os.sep
+    try:
+        for i in range(20):
+            rhinosim.writePng(folder + "person{}.png".format(i), 40 + i, 120)
+        yield folder
+    finally:
+        shutil.rmtree(folder)
+
+def benchComponent(n):
+    """Loading, orienting and reloading n entourages with the component
+    script
+
+    Every session runs twice on a new document: timed, then traced for
+    the peak memory (tracing slows it down several times). The first
+    reload moves one anchor, which must only move that entourage. The
+    second inserts an anchor in front of it, which must only add one.
+    """
+    anchors = list(zip(*randomAnchors(n)))
+    moved = [(anchors[0][0] + 0.5, anchors[0][1])] + anchors[1:]
+    inserted = [(-1.0, -1.0)] + moved
+    with imageLibrary() as folder:
+        def session(trace):
+            doc = rhinosim.newDocument()
+            scope = componentScope(folder, anchors)
+            viewport = doc.Views.ActiveView.ActiveViewport
+            results = []
+            for case, inputs, direction, changes in (
+                    ("load", dict(load=True), (0, 1, 0), None),
+                    ("orient", dict(load=False, orient=True), (1, 1, 0),
+                     None),
+                    ("reload, 1 moved", dict(load=True, orient=False,
+                                             point=anchorTree(moved)),
+                     (1, 1, 0), (1, 0, 0)),
+                    ("reload, 1 inserted", dict(point=anchorTree(inserted)),
+                     (1, 1, 0), (0, 1, 0))):
+                viewport.CameraDirection = rhinosim.Vector3d(*direction)
+                seconds, calls, peak = runComponent(scope, trace, **inputs)
+                results.append((case, seconds, calls, peak,
+                                len(doc.Objects)))
+                if changes is not None:
+                    counters = scope["stats"]["counters"]
+                    assert (counters.get("moved"), counters.get("added"),
+                            counters.get("deleted")) == changes, counters
+            return results
+        timed, traced = session(False), session(True)
+    for (case, seconds, calls, _, objects), traces in zip(timed, traced):
+        report("component", case, n, seconds)
+        print("{:<12} {:.2f} calls per object, peak {:.1f} MB".format(
+            "", calls / float(max(1, objects)), traces[3] / 1e6))
+
+def benchProxy(n):
+    """Loading n entourages in proxy mode, then swapping their textures to
+    full resolution and back
+
+    Each swap must point the bitmap of every material at the library
+    images, then back at the proxies.
+    """
+    with imageLibrary() as folder:
+        doc = rhinosim.newDocument()
+        scope = componentScope(folder, list(zip(*randomAnchors(n))))
+        bitmaps = []
+        for case, inputs in (("load proxies", dict(load=True, proxy=True)),
+                             ("swap to full", dict(load=False, proxy=False)),
+                             ("swap to proxies", dict(load=False, proxy=True))):
+            seconds, calls, _ = runComponent(scope, **inputs)
+            report("proxy", case, n, seconds)
+            print("{:<12} {:.2f} calls per object".format(
+                "", calls / float(max(1, len(doc.Objects)))))
+            textures = [doc.Materials[i].GetBitmapTexture()
+                        for i in range(len(doc.Materials))]
+            bitmaps.append(set(t.FileName for t in textures if t))
+    proxies, full, swapped = bitmaps
+    assert full and all(os.path.dirname(f) + os.sep == folder
+                        for f in full), full
+    assert proxies and proxies.isdisjoint(full) and swapped == proxies
+
+def benchPreview(n):
+    """Preparing the quads of n entourages for the display conduit, and
+    previewing them with the component instead of placing them"""
+    files = ["person{}.png".format(i) for i in range(20)]
+    xs, ys = randomAnchors(n)
+    plan = planPlacements([(x, y, 0.0) for x, y in zip(xs, ys)], files,
+                          [(40, 120)]*len(files), [1.8]*n, 0, (0, 1))
+    report("preview", "quad vertices", n,
+           bestOf(lambda: quadBounds(previewGroups(plan))))
+    with imageLibrary() as folder:
+        for case, preview in (("component preview", True),
+                              ("component load", False)):
+            doc = rhinosim.newDocument()
+            scope = componentScope(folder, list(zip(xs, ys)),
+                                   preview=preview)
+            seconds, calls, _ = runComponent(scope, load=True)
+            report("preview", case, n, seconds)
+            print("{:<12} {} document calls, {} objects".format(
+                "", calls, len(doc.Objects)))
+            scope["conduit"].clear()
+
+def benchMerge(n):
+    """Loading and orienting n entourages as picture frames, then as one
+    merged mesh per image"""
+    anchors = list(zip(*randomAnchors(n)))
+    with imageLibrary() as folder:
+        for mode, merge in (("frames", False), ("merged", True)):
+            doc = rhinosim.newDocument()
+            scope = componentScope(folder, anchors, merge=merge)
+            viewport = doc.Views.ActiveView.ActiveViewport
+            for case, inputs, direction in (
+                    ("load", dict(load=True, orient=False), (0, 1, 0)),
+                    ("orient", dict(load=False, orient=True), (1, 1, 0))):
+                viewport.CameraDirection = rhinosim.Vector3d(*direction)
+                seconds, calls, _ = runComponent(scope, **inputs)
+                report("merge", "{}, {}".format(case, mode), n, seconds)
+                print("{:<12} {} document calls, {} objects".format(
+                    "", calls, len(doc.Objects)))
+
+def benchQuery(n):
+    """Indexing n anchors and querying them, against scanning every anchor"""
+    xs, ys = randomAnchors(n)
+    report("query", "build index", n, bestOf(lambda: AnchorIndex(xs, ys)))
+    index = AnchorIndex(xs, ys)
+    rnd = random.Random(1)
+    points = [(rnd.uniform(0, 1000), rnd.uniform(0, 1000)) for _ in range(100)]
+    square = [[(400, 400), (600, 400), (600, 600), (400, 600)]]
+    for case, query in (
+            ("100 radius queries", lambda: [index.radius(x, y, 20)
+                                            for x, y in points]),
+            ("100 nearest queries", lambda: [index.nearest(x, y)
+                                             for x, y in points]),
+            ("polygon query", lambda: index.polygon(square)),
+            ("10 radius scans", lambda: [
+                [i for i in range(n) if (xs[i] - x)**2 + (ys[i] - y)**2 <= 400]
+                for x, y in points[:10]])):
+        report("query", case, n, bestOf(query))
+
+def benchExport(n):
+    """Streaming n instances of 20 images to glTF and OBJ"""
+    folder = tempfile.mkdtemp()
+    try:
+        files = [os.path.join(folder, "person{}.png".format(i))
+                 for i in range(20)]
+        xs, ys = randomAnchors(n)
+        plan = planPlacements([(x, y, 0.0) for x, y in zip(xs, ys)], files,
+                              [(40, 120)]*len(files), [1.8]*n, 0, (0, 1))
+        for case, write, name in (("gltf, gpu instancing", writeGltf,
+                                   "scene.gltf"),
+                                  ("obj fallback", writeObj, "scene.obj")):
+            out = os.path.join(folder, name)
+            report("export", case, n, bestOf(lambda: write(plan, out), 1))
+    finally:
+        shutil.rmtree(folder)
+
+def benchPrewarm(n):
+    """Reading 200 images with 5 ms of simulated share latency each
+
+    n is ignored, the number of unique textures does not grow with it.
+    """
+    def read(path):
+        time.sleep(0.005)
+        return 1
+    paths = ["image{}.png".format(i) for i in range(200)]
+    for workers in (1, 8):
+        seconds = bestOf(lambda: prewarm(paths, workers, read), 1)
+        report("prewarm", "{} workers".format(workers), len(paths), seconds)
+
+def benchMirror(n):
+    """Mirroring 200 images of 256 KB into a cold, then a warm cache
+
+    n is ignored, the number of unique textures does not grow with it.
+    """
+    source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(source, "image{}.png".format(i))
+                 for i in range(200)]
+        for p in paths:
+            with open(p, "wb") as f:
+                f.write(os.urandom(256 << 10))
+        for case in ("cold", "warm"):
+            cache = MirrorCache(root)
+            seconds = bestOf(lambda: cache.fetchAll(paths), 1)
+            report("mirror", case, len(paths), seconds)
+    finally:
+        shutil.rmtree(source)
+        shutil.rmtree(root)
+
+SUITES = {
+    "billboard": benchBillboard,
+    "component": benchComponent,
+    "culling": benchCulling,
+    "export": benchExport,
+    "merge": benchMerge,
+    "mirror": benchMirror,
+    "proxy": benchProxy,
+    "query": benchQuery,
+    "prewarm": benchPrewarm,
+    "preview": benchPreview,
+    "region": benchRegion,
+    "resolve": benchResolve,
+    "sampling": benchSampling,
+    "spread": benchSpread,
+    "store": benchStore,
+    "treehandler": benchTreeHandler,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("suites", nargs="*", default=sorted(SUITES))
+    parser.add_argument("-n", type=int, nargs="+", default=list(SIZES))
+    args = parser.parse_args()
+    for suite in args.suites:
+        for n in args.n:
+            SUITES[suite](n)
+
+if __name__ == "__main__":
+    main()
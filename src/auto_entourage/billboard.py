@@ -0,0 +1,62 @@
+"""Billboard orientation of entourages for perspective views
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import math
+
+def anchorYaws(xs, ys, eyeX, eyeY):
+    """Returns the yaw (in degrees) of every anchor facing the eye point
+
+    The yaw is the angle of the projected direction from the eye to the
+    anchor, matching the camera direction used in parallel views.
+
+    Args:
+        xs (list of float): x coordinates of the anchors
+        ys (list of float): y coordinates of the anchors
+        eyeX (float): x coordinate of the camera location or target
+        eyeY (float): y coordinate of the camera location or target
+    Returns:
+        list of yaws in degrees
+    """
+    atan2, degrees = math.atan2, math.degrees
+    return [degrees(atan2(y - eyeY, x - eyeX)) for x, y in zip(xs, ys)]
+
+def yawDeltas(old, new):
+    """Returns the signed rotations (in degrees) turning old yaws to new
+
+    Args:
+        old (list of float): the current yaws
+        new (list of float): the target yaws
+    Returns:
+        list of angles wrapped to [-180, 180)
+    """
+    return [(b - a + 180.0) % 360.0 - 180.0 for a, b in zip(old, new)]
+
+def yawVectors(yaws):
+    """Returns the unit XY direction (x, y, z) of every yaw"""
+    cos, sin, radians = math.cos, math.sin, math.radians
+    return [(cos(radians(a)), sin(radians(a)), 0.0) for a in yaws]
+
+class BillboardCache:
+    """Caches the anchor yaws of the last eye point
+
+    Yaws are only recomputed when the eye point moves on the XY plane.
+    """
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.eye = None
+        self.yaws = None
+
+    def yawsFor(self, eye):
+        """Returns the (cached) yaws facing the eye point
+
+        Args:
+            eye (tuple): the (x, y, ...) coordinates of the eye point
+        """
+        eye = (eye[0], eye[1])
+        if eye != self.eye:
+            self.eye = eye
+            self.yaws = anchorYaws(self.xs, self.ys, eye[0], eye[1])
+        return self.yaws
@@ -0,0 +1,106 @@
+"""View frustum culling and level of detail for entourages
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import math
+
+CULLED = -1
+
+def frustumPlanes(m):
+    """Returns the frustum planes of a world to clip transform
+
+    Args:
+        m (list): 4x4 row-major world to clip matrix
+    Returns:
+        list of six (a, b, c, d) planes, normalized and facing inwards
+    """
+    planes = []
+    for row in (m[0], m[1], m[2]):
+        for sign in (1, -1):
+            plane = [m[3][k] + sign*row[k] for k in range(4)]
+            length = math.sqrt(plane[0]**2 + plane[1]**2 + plane[2]**2)
+            if length > 0:
+                plane = [c / length for c in plane]
+            planes.append(tuple(plane))
+    return planes
+
+def boundingSpheres(xs, ys, zs, widths, heights):
+    """Returns centers and radii of spheres bounding vertical frames
+
+    Frames are centered on their anchor horizontally and rise from it.
+    """
+    cz = [z + 0.5*h for z, h in zip(zs, heights)]
+    radii = [0.5*math.sqrt(w*w + h*h) for w, h in zip(widths, heights)]
+    return xs, ys, cz, radii
+
+def spheresVisible(planes, xs, ys, zs, radii):
+    """Returns whether every sphere intersects the frustum"""
+    visible = [True]*len(xs)
+    for a, b, c, d in planes:
+        visible = [v and a*x + b*y + c*z + d >= -r for v, x, y, z, r
+                   in zip(visible, xs, ys, zs, radii)]
+    return visible
+
+def projectedHeights(m, xs, ys, zs, heights, viewportHeight):
+    """Returns the height (in pixels) of vertical frames on screen"""
+    def ndcY(x, y, z):
+        w = m[3][0]*x + m[3][1]*y + m[3][2]*z + m[3][3]
+        if w <= 0:
+            return None
+        return (m[1][0]*x + m[1][1]*y + m[1][2]*z + m[1][3]) / w
+
+    result = []
+    for x, y, z, h in zip(xs, ys, zs, heights):
+        bottom, top = ndcY(x, y, z), ndcY(x, y, z + h)
+        if bottom is None or top is None:
+            result.append(float(viewportHeight))
+        else:
+            result.append(0.5*abs(top - bottom)*viewportHeight)
+    return result
+
+def lodLevels(pixelHeights, thresholds):
+    """Returns the level of detail for every projected height
+
+    Args:
+        pixelHeights (list of float): projected heights in pixels
+        thresholds (tuple): descending minimum pixel heights per level
+    Returns:
+        list of levels, len(thresholds) being the coarsest level
+    """
+    def level(px):
+        for i, t in enumerate(thresholds):
+            if px >= t:
+                return i
+        return len(thresholds)
+    return [level(px) for px in pixelHeights]
+
+def cullLevels(m, viewportHeight, xs, ys, zs, widths, heights, thresholds):
+    """Returns the level of detail of every entourage, or CULLED
+
+    Args:
+        m (list): 4x4 row-major world to clip matrix of the view
+        viewportHeight (int): the viewport height in pixels
+        xs, ys, zs (list of float): anchor coordinates
+        widths, heights (list of float): frame sizes in model units
+        thresholds (tuple): descending minimum pixel heights per level
+    """
+    cx, cy, cz, radii = boundingSpheres(xs, ys, zs, widths, heights)
+    visible = spheresVisible(frustumPlanes(m), cx, cy, cz, radii)
+    index = [i for i, v in enumerate(visible) if v]
+    pick = lambda values: [values[i] for i in index]
+    pixels = projectedHeights(m, pick(xs), pick(ys), pick(zs),
+                              pick(heights), viewportHeight)
+    levels = [CULLED]*len(xs)
+    for i, lod in zip(index, lodLevels(pixels, thresholds)):
+        levels[i] = lod
+    return levels
+
+def lodCounts(levels):
+    """Returns the number of visible and culled entourages and the number
+    of entourages per level of detail"""
+    perLevel = {}
+    for lod in levels:
+        perLevel[lod] = perLevel.get(lod, 0) + 1
+    culled = perLevel.pop(CULLED, 0)
+    return len(levels) - culled, culled, perLevel
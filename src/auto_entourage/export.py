@@ -0,0 +1,162 @@
+"""Export of entourage placements to glTF 2.0 and OBJ
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import json
+import math
+import os
+import struct
+
+CHUNK_SIZE = 4096 # instances per write
+FLOAT, UINT16 = 5126, 5123 # glTF component types
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+QUAD_POSITIONS = (0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0)
+QUAD_UVS = (0, 1, 1, 1, 1, 0, 0, 0)
+QUAD_INDICES = (0, 1, 2, 0, 2, 3)
+
+def groupByImage(plan):
+    """Returns the instance indices of every image of the plan"""
+    groups = [[] for _ in plan["files"]]
+    for i, image in enumerate(plan["image"]):
+        groups[image].append(i)
+    return groups
+
+def instanceTransform(plan, i):
+    """Returns the glTF (Y up) translation, rotation and scale of item i
+
+    Rhino is Z up, so (x, y, z) becomes (x, z, -y), and the quad turns
+    about the up axis to the frame's x axis.
+    """
+    x, y, z = plan["origin"][3*i:3*i+3]
+    ax, ay = plan["xAxis"][2*i:2*i+2]
+    half = 0.5 * math.atan2(ay, ax)
+    return ((x, z, -y), (0.0, math.sin(half), 0.0, math.cos(half)),
+            (plan["width"][i], plan["height"][i], 1.0))
+
+def writeGltf(plan, path, chunkSize=CHUNK_SIZE):
+    """Writes the plan to path (.gltf) and its buffer next to it (.bin)
+
+    Returns:
+        the number of instances written
+    """
+    base = os.path.splitext(path)[0]
+    binPath = base + ".bin"
+    folder = os.path.dirname(os.path.abspath(path))
+    groups = groupByImage(plan)
+    views, accessors = [], []
+
+    def addView(offset, length, target=None):
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": length}
+        if target:
+            view["target"] = target
+        views.append(view)
+        return len(views) - 1
+
+    def addAccessor(view, count, kind, componentType=FLOAT, bounds=None):
+        accessor = {"bufferView": view, "componentType": componentType,
+                    "count": count, "type": kind}
+        if bounds:
+            accessor["min"], accessor["max"] = bounds
+        accessors.append(accessor)
+        return len(accessors) - 1
+
+    with open(binPath, "wb") as f:
+        quad = struct.pack("<12f", *QUAD_POSITIONS)
+        uvs = struct.pack("<8f", *QUAD_UVS)
+        indices = struct.pack("<6H", *QUAD_INDICES)
+        f.write(quad + uvs + indices)
+        position = addAccessor(addView(0, 48, ARRAY_BUFFER), 4, "VEC3",
+                               bounds=([0, 0, 0], [1, 1, 0]))
+        texcoord = addAccessor(addView(48, 32, ARRAY_BUFFER), 4, "VEC2")
+        index = addAccessor(addView(80, 12, ELEMENT_ARRAY_BUFFER), 6,
+                            "SCALAR", UINT16)
+        offset = 92 # 4-byte aligned already
+        meshes, nodes = [], []
+        for image, members in enumerate(groups):
+            if not members:
+                continue
+            count = len(members)
+            attributes = {}
+            for name, width in (("TRANSLATION", 3), ("ROTATION", 4),
+                                ("SCALE", 3)):
+                part = ("TRANSLATION", "ROTATION", "SCALE").index(name)
+                for start in range(0, count, chunkSize):
+                    values = []
+                    for i in members[start:start+chunkSize]:
+                        values.extend(instanceTransform(plan, i)[part])
+                    f.write(struct.pack("<{}f".format(len(values)), *values))
+                length = 4 * width * count
+                attributes[name] = addAccessor(
+                    addView(offset, length), count, ("VEC3", "VEC4")[
+                        width == 4])
+                offset += length
+            meshes.append({"primitives": [{
+                "attributes": {"POSITION": position, "TEXCOORD_0": texcoord},
+                "indices": index, "material": len(meshes)}]})
+            nodes.append({"mesh": len(meshes) - 1, "extensions": {
+                "EXT_mesh_gpu_instancing": {"attributes": attributes}}})
+    images = [{"uri": os.path.relpath(plan["files"][image], folder).replace(
+                  os.sep, "/")}
+              for image, members in enumerate(groups) if members]
+    gltf = {
+        "asset": {"version": "2.0", "generator": "Auto Entourage"},
+        "extensionsUsed": ["EXT_mesh_gpu_instancing"],
+        "scene": 0, "scenes": [{"nodes": list(range(len(nodes)))}],
+        "nodes": nodes, "meshes": meshes,
+        "materials": [{"pbrMetallicRoughness": {
+                           "baseColorTexture": {"index": i},
+                           "metallicFactor": 0.0},
+                       "alphaMode": "MASK", "doubleSided": True}
+                      for i in range(len(images))],
+        "textures": [{"source": i} for i in range(len(images))],
+        "images": images,
+        "buffers": [{"uri": os.path.basename(binPath), "byteLength": offset}],
+        "bufferViews": views, "accessors": accessors}
+    with open(path, "w") as f:
+        json.dump(gltf, f, separators=(",", ":"))
+    return len(plan["image"])
+
+def writeObj(plan, path, chunkSize=CHUNK_SIZE):
+    """Writes the plan to path (.obj) and a material library (.mtl)
+
+    Returns:
+        the number of instances written
+    """
+    base = os.path.splitext(path)[0]
+    mtlPath = base + ".mtl"
+    groups = groupByImage(plan)
+    with open(mtlPath, "w") as f:
+        for image, members in enumerate(groups):
+            if members:
+                texture = plan["files"][image]
+                f.write("newmtl image{0}\nmap_Kd {1}\nmap_d {1}\n\n".format(
+                    image, texture))
+    with open(path, "w") as f:
+        f.write("mtllib {}\n".format(os.path.basename(mtlPath)))
+        f.write("vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\n")
+        vertex = 1
+        for image, members in enumerate(groups):
+            if not members:
+                continue
+            f.write("usemtl image{}\n".format(image))
+            for start in range(0, len(members), chunkSize):
+                lines = []
+                for i in members[start:start+chunkSize]:
+                    x, y, z = plan["origin"][3*i:3*i+3]
+                    ax, ay = plan["xAxis"][2*i:2*i+2]
+                    w, h = plan["width"][i], plan["height"][i]
+                    for u, v in ((0, 0), (1, 0), (1, 1), (0, 1)):
+                        lines.append("v {:.6f} {:.6f} {:.6f}\n".format(
+                            x + u*w*ax, y + u*w*ay, z + v*h))
+                    lines.append("f {0}/1 {1}/2 {2}/3 {3}/4\n".format(
+                        vertex, vertex + 1, vertex + 2, vertex + 3))
+                    vertex += 4
+                f.write("".join(lines))
+    return len(plan["image"])
+
+def exportPlan(plan, path):
+    """Writes the plan as glTF or OBJ depending on the extension of path"""
+    if path.lower().endswith(".obj"):
+        return writeObj(plan, path)
+    return writeGltf(plan, path)
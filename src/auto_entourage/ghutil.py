@@ -4,10 +4,16 @@ __author__ = "Vincent Mai"
 __version__ = "2020.10.05"
 
 import System
+import collections
+import threading
+import time
+import Rhino
 import Rhino.RhinoDoc
 import scriptcontext as sc
 from Grasshopper import DataTree
+from Grasshopper.Kernel.Data import GH_Path
 import ghpythonlib.treehelpers as th
+from preview import QUAD_UVS
 
 class RhinoDocContext:
     """Context Manager to enter the RhinoDoc.ActiveDoc Context
@@ -22,14 +28,13 @@ class RhinoDocContext:
     def __exit__(self, type, value, traceback):
         sc.doc = self.ghdoc
 
-class NewLayerContext:
-    """Context Manager to call a function in a new layer
+class LayerContext:
+    """Context Manager to call a function in a layer, created if missing
     """
     def __init__(self, layer_name):
         self.layer_name = layer_name
 
     def __enter__(self):
-        self.__deleteLayer(self.layer_name)
         self.__createAndSetCurrentLayer(self.layer_name)
 
     def __exit__(self, type, value, traceback):
@@ -51,26 +56,283 @@ class NewLayerContext:
         """
         with RhinoDocContext():
             sc.doc.Layers.SetCurrentLayerIndex(0, True)
-            
+
+class NewLayerContext(LayerContext):
+    """Context Manager to call a function in a new layer
+    """
+    def __enter__(self):
+        self.__deleteLayer(self.layer_name)
+        LayerContext.__enter__(self)
+
     def __deleteLayer(self, layer_name):
         """Deletes a layer and all objects inside
         """
         with RhinoDocContext():
             rhinoObjects = sc.doc.Objects.FindByLayer(layer_name)
             if rhinoObjects:
-                for obj in rhinoObjects:
-                    sc.doc.Objects.Delete(obj)
+                sc.doc.Objects.Delete([obj.Id for obj in rhinoObjects], True)
             sc.doc.Layers.SetCurrentLayerIndex(0, True)
             sc.doc.Layers.Delete(sc.doc.Layers.FindName(layer_name), True)
 
+class Debouncer:
+    """Coalesces bursts of events into a single deferred call
+
+    Every trigger restarts the quiet interval, and at most one call is ever
+    pending, so a burst of events results in a single call to func.
+    """
+    def __init__(self, func, interval, clock=time.time):
+        self.func = func
+        self.interval = interval
+        self.clock = clock
+        self.pending = False
+        self.lastEvent = None
+
+    def trigger(self, *args):
+        """Marks a call as pending and restarts the quiet interval"""
+        self.pending = True
+        self.lastEvent = self.clock()
+
+    def poll(self, *args):
+        """Calls func if a call is pending and the interval has elapsed
+
+        Returns:
+            True if func was called
+        """
+        if not self.pending or self.clock() - self.lastEvent < self.interval:
+            return False
+        self.pending = False
+        self.func()
+        return True
+
+class ViewChangeWatcher:
+    """Calls a function once the viewports stop changing
+
+    Camera changes are collected from RhinoView.Modified into a Debouncer,
+    which is polled on RhinoApp.Idle so that func runs on the UI thread.
+    """
+    def __init__(self, func, interval):
+        self.debouncer = Debouncer(func, interval)
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        Rhino.Display.RhinoView.Modified += self.debouncer.trigger
+        Rhino.RhinoApp.Idle += self.debouncer.poll
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        Rhino.Display.RhinoView.Modified -= self.debouncer.trigger
+        Rhino.RhinoApp.Idle -= self.debouncer.poll
+        self.debouncer.pending = False
+        self.running = False
+
+class BackgroundJob:
+    """Plans on a worker thread, then commits the plan in chunks on the
+    UI thread
+
+    Chunks are committed from RhinoApp.Idle, so Rhino stays responsive
+    between them. A cancelled or failed job calls rollback (on the UI
+    thread) instead of finish.
+
+    Args:
+        plan (callable): returns the list of items to commit, run on the
+            worker thread
+        commit (callable): commits a list of items
+        chunkSize (int): the number of items per commit
+        progress (callable): (Optional) called with (done, total), total
+            being None while planning
+        finish (callable): (Optional) called once everything is committed
+        rollback (callable): (Optional) called with the error, or None if
+            cancelled, after a failure or cancel
+    """
+    def __init__(self, plan, commit, chunkSize, progress=None, finish=None,
+                 rollback=None):
+        self.plan = plan
+        self.commit = commit
+        self.chunkSize = chunkSize
+        self.progress = progress or (lambda done, total: None)
+        self.finish = finish or (lambda: None)
+        self.rollback = rollback or (lambda error: None)
+        self.items = None
+        self.error = None
+        self.done = 0
+        self.planned = threading.Event()
+        self.cancelled = False
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        worker = threading.Thread(target=self.__plan)
+        worker.daemon = True
+        worker.start()
+        Rhino.RhinoApp.Idle += self.step
+
+    def cancel(self):
+        """Stops the job; the rollback runs on the next step"""
+        self.cancelled = True
+
+    def __plan(self):
+        try:
+            self.items = self.plan()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.planned.set()
+
+    def __stop(self):
+        Rhino.RhinoApp.Idle -= self.step
+        self.running = False
+
+    def step(self, *args):
+        """Commits the next chunk
+
+        Returns:
+            True if the job is still running
+        """
+        if not self.running:
+            return False
+        if self.cancelled or self.error is not None:
+            self.__stop()
+            self.rollback(self.error)
+            return False
+        if not self.planned.is_set():
+            self.progress(0, None)
+            return True
+        chunk = self.items[self.done:self.done + self.chunkSize]
+        try:
+            self.commit(chunk)
+        except Exception as e:
+            self.error = e
+            return self.step()
+        self.done += len(chunk)
+        self.progress(self.done, len(self.items))
+        if self.done >= len(self.items):
+            self.__stop()
+            self.finish()
+            return False
+        return True
+
+class PreviewConduit(Rhino.Display.DisplayConduit):
+    """Draws textured quads in the viewports without adding objects to
+    the document
+
+    Every image is drawn as one mesh with its own display material, so
+    the conduit makes one draw call per image however many quads use it.
+    """
+    def __init__(self):
+        self.meshes = []
+        self.materials = {}
+        self.bounds = None
+        self.plan = None
+
+    def show(self, groups, bounds, plan=None):
+        """Replaces the quads drawn
+
+        Args:
+            groups (list): (texture, vertices, count) per image, as made by
+                preview.previewGroups
+            bounds (tuple): the (min, max) corners around all quads
+            plan (dict): (Optional) the plan the quads were made from
+        """
+        self.meshes = [(quadMesh(vertices, count), self.__material(texture))
+                       for texture, vertices, count in groups]
+        self.bounds = None
+        if bounds is not None:
+            self.bounds = Rhino.Geometry.BoundingBox(
+                Rhino.Geometry.Point3d(*bounds[0]),
+                Rhino.Geometry.Point3d(*bounds[1]))
+        self.plan = plan
+        self.Enabled = True
+        sc.doc.Views.Redraw()
+
+    def clear(self):
+        """Stops drawing and releases the meshes"""
+        self.Enabled = False
+        self.meshes = []
+        self.bounds = None
+        self.plan = None
+        sc.doc.Views.Redraw()
+
+    def __material(self, texture):
+        if texture not in self.materials:
+            material = Rhino.Display.DisplayMaterial()
+            material.SetBitmapTexture(texture, True)
+            material.SetTransparencyTexture(texture, True)
+            self.materials[texture] = material
+        return self.materials[texture]
+
+    def CalculateBoundingBox(self, e):
+        if self.bounds is not None:
+            e.IncludeBoundingBox(self.bounds)
+
+    def PostDrawObjects(self, e):
+        for mesh, material in self.meshes:
+            e.Display.DrawMeshShaded(mesh, material)
+
+def quadMesh(vertices, count):
+    """Returns a mesh of textured quads
+
+    Args:
+        vertices (array of float): (x, y, z) of the 4 corners of each quad
+        count (int): the number of quads
+    """
+    rg = Rhino.Geometry
+    mesh = rg.Mesh()
+    mesh.Vertices.AddVertices([rg.Point3f(vertices[i], vertices[i+1],
+                                          vertices[i+2])
+                               for i in range(0, 12*count, 3)])
+    mesh.Faces.AddFaces([rg.MeshFace(i, i+1, i+2, i+3)
+                         for i in range(0, 4*count, 4)])
+    uvs = [rg.Point2f(QUAD_UVS[i], QUAD_UVS[i+1]) for i in range(0, 8, 2)]
+    mesh.TextureCoordinates.AddRange(System.Array[rg.Point2f](uvs*count))
+    return mesh
+
+def isNested(item):
+    """Returns whether th.list_to_tree would expand item into a branch
+
+    IronPython strings have no __iter__, the check for str keeps CPython
+    stand-ins consistent with it.
+    """
+    return hasattr(item, "__iter__") and not isinstance(item, str)
+
 class TreeHandler:
     """Decorating class to handle trees as args for user define functions
+
+    Args are matched against each other by longest list. The matching is
+    planned per output branch as runs of each tree's AllData(), which are
+    sliced into flat columns, and the output tree is assembled directly.
+    Trees with holes, empty branches or mixed depths fall back to matching
+    on nested lists.
+
+    Plans are cached by the topology fingerprint of the args (paths and
+    branch sizes), so calls over trees of the same shape skip planning.
+    Only the branch-level plan is cached, so its size does not grow with
+    the item count.
     """
+    PLAN_CACHE_SIZE = 16
+    planCache = collections.OrderedDict()
+    cacheHits = 0
+    cacheMisses = 0
+
     def __init__(self, func):
         self.func = func
         
     def __call__(self, *args, **kwargs):
-        args = map(TreeHandler.toTree, args)
+        args = [TreeHandler.toTree(arg) for arg in args]
+        plan = TreeHandler.cachedPlan(args)
+        if plan is None:
+            return self.__callNested(args)
+        columns = TreeHandler.gather(args, plan)
+        results = [self.func(*row) for row in zip(*columns)]
+        return TreeHandler.assemble(plan, results)
+
+    def __callNested(self, args):
+        """Matches args by converting them to nested lists"""
         depths = [self.__treeDepth(t) for t in args]
         lsts = [th.tree_to_list(arg, lambda x: x[0]) for arg in args]
         return th.list_to_tree(self.__interlace_depth(lsts, depths))
@@ -104,6 +366,185 @@ class TreeHandler:
             for j in range(max_depth-d):
                 lsts[idx] = [lsts[idx]]
         return self.__interlace_size(lsts)
+
+    @staticmethod
+    def fingerprint(tree):
+        """Returns the topology of a tree as ((path indices, count), ...)
+        """
+        return tuple((tuple(tree.Path(i).Indices), tree.Branch(i).Count)
+                     for i in range(tree.BranchCount))
+
+    @staticmethod
+    def cachedPlan(trees):
+        """Returns the (cached) matching plan of trees
+
+        Returns:
+            the plan made by matchPlan, or None if the trees need nested
+            matching
+        """
+        cache = TreeHandler.planCache
+        key = tuple(TreeHandler.fingerprint(t) for t in trees)
+        if key in cache:
+            TreeHandler.cacheHits += 1
+            plan = cache.pop(key)
+        else:
+            TreeHandler.cacheMisses += 1
+            shapes = [TreeHandler.treeShape(fp) for fp in key]
+            plan = None
+            if None not in shapes:
+                plan = TreeHandler.matchPlan(shapes)
+            if len(cache) >= TreeHandler.PLAN_CACHE_SIZE:
+                cache.popitem(last=False)
+        cache[key] = plan
+        return plan
+
+    @staticmethod
+    def cacheInfo():
+        """Returns the hits, misses and size of the plan cache"""
+        return {"hits": TreeHandler.cacheHits,
+                "misses": TreeHandler.cacheMisses,
+                "size": len(TreeHandler.planCache)}
+
+    @staticmethod
+    def treeShape(fingerprint):
+        """Returns the nesting of a tree with (offset, count) branches
+
+        Mirrors th.tree_to_list(tree, lambda x: x[0]): only paths under
+        the first root index are kept, and each branch is replaced by its
+        offset and item count in tree.AllData().
+
+        Args:
+            fingerprint (tuple): the topology of the tree
+        Returns:
+            (nested lists of (offset, count), depth), or None if the tree
+            has holes, empty branches or paths of different lengths
+        """
+        if not fingerprint:
+            return None
+        length = len(fingerprint[-1][0])
+        root = []
+        offset = 0
+        for path, count in fingerprint:
+            if len(path) != length or count == 0:
+                return None
+            if path[0] == 0:
+                node = root
+                for d in range(1, length):
+                    if path[d] > len(node):
+                        return None
+                    if path[d] == len(node):
+                        node.append([] if d < length-1 else None)
+                    if d < length-1:
+                        node = node[path[d]]
+                if length == 1:
+                    root = (offset, count)
+                elif node[path[-1]] is not None:
+                    return None
+                else:
+                    node[path[-1]] = (offset, count)
+            offset += count
+        if not root:
+            return None
+        return TreeHandler.__checkShape(root, length) and (root, length)
+
+    @staticmethod
+    def __checkShape(node, depth):
+        """Returns whether every node at depth is a filled branch"""
+        if depth == 1:
+            return isinstance(node, tuple)
+        return (isinstance(node, list) and len(node) > 0 and
+                all(TreeHandler.__checkShape(n, depth-1) for n in node))
+
+    @staticmethod
+    def matchPlan(shapes):
+        """Returns the longest-list matching of tree shapes
+
+        Returns:
+            list of (track, counts, offsets) per output branch, where track
+            is the output path below the root, counts the branch sizes and
+            offsets the branch offsets of every input
+        """
+        maxDepth = max(depth for node, depth in shapes)
+        nodes = []
+        for node, depth in shapes:
+            for j in range(maxDepth-depth):
+                node = [node]
+            nodes.append(node)
+        plan = []
+        def walk(nodes, track):
+            if isinstance(nodes[0], tuple):
+                plan.append((track, [c for o, c in nodes],
+                             [o for o, c in nodes]))
+                return
+            for i in range(max([len(n) for n in nodes])):
+                walk([n[min(i, len(n)-1)] for n in nodes], track + (i,))
+        walk(nodes, ())
+        return plan
+
+    @staticmethod
+    def gather(trees, plan):
+        """Returns one flat column of matched items per tree
+
+        Each branch of a tree is sliced from its AllData() and padded with
+        its last item up to the size of the output branch.
+        """
+        items = [list(t.AllData()) for t in trees]
+        columns = [[] for t in trees]
+        for track, counts, offsets in plan:
+            size = max(counts)
+            for column, data, c, o in zip(columns, items, counts, offsets):
+                column.extend(data[o:o+c])
+                if c < size:
+                    column.extend([data[o+c-1]]*(size-c))
+        return columns
+
+    @staticmethod
+    def assemble(plan, results):
+        """Returns the output tree of the flat results of a plan
+
+        Results are inserted as th.list_to_tree would insert the nested
+        results, so results that are lists become sub-branches.
+        """
+        tree = DataTree[object]()
+        start = 0
+        for track, counts, offsets in plan:
+            size = max(counts)
+            branch = results[start:start+size]
+            start += size
+            path = [0] + list(track)
+            if any(isNested(item) for item in branch):
+                TreeHandler.__insert(tree, branch, path)
+            else:
+                tree.AddRange(branch, GH_Path(System.Array[int](path)))
+        return tree
+
+    @staticmethod
+    def __shapeSizes(node):
+        """Returns the branch sizes of a tree shape as nested lists, as
+        treeTopology does on the nested list of the tree"""
+        result = []
+        for child in node:
+            if isinstance(child, list):
+                result.append(TreeHandler.__shapeSizes(child))
+                result.append([len(child)])
+            else:
+                result.append([child[1]])
+        return result
+
+    @staticmethod
+    def __insert(tree, items, track):
+        """Inserts nested items into tree as th.list_to_tree does"""
+        path = GH_Path(System.Array[int](track))
+        if len(items) == 0:
+            tree.EnsurePath(path)
+            return
+        for i, item in enumerate(items):
+            if isNested(item):
+                track.append(i)
+                TreeHandler.__insert(tree, item, track)
+                track.pop()
+            else:
+                tree.Insert(item, path, i)
     
     @staticmethod
     def toTree(arg):
@@ -117,6 +558,45 @@ class TreeHandler:
             else:
                 return th.list_to_tree(arg)
     
+    @staticmethod
+    def match(*args):
+        """Matches args against each other as the decorated functions do
+
+        Returns:
+            (list, gh.DataTree) one flat column of matched items per arg,
+            and a tree with the shape of the matched output
+        """
+        trees = [TreeHandler.toTree(arg) for arg in args]
+        plan = TreeHandler.cachedPlan(trees)
+        if plan is None:
+            trees = [TreeHandler(lambda *items: items[k])(*trees)
+                     for k in range(len(trees))]
+            return [list(t.AllData()) for t in trees], trees[0]
+        columns = TreeHandler.gather(trees, plan)
+        return columns, TreeHandler.assemble(plan, [None]*len(columns[0]))
+
+    @staticmethod
+    def fromFlat(items, template):
+        """Returns a DataTree of items shaped like the template tree
+
+        Items are consumed in the order of template.AllData(), so the
+        result has the paths and branch sizes of the template.
+        """
+        tree = DataTree[object]()
+        start = 0
+        for i in range(template.BranchCount):
+            count = template.Branch(i).Count
+            tree.AddRange(items[start:start+count], template.Path(i))
+            start += count
+        return tree
+
+    @staticmethod
+    def itemKeys(tree):
+        """Returns a (path, index) key per item, ordered as tree.AllData()
+        """
+        return [(str(tree.Path(i)), j) for i in range(tree.BranchCount)
+                for j in range(tree.Branch(i).Count)]
+
     @staticmethod
     def treeTopology(tree):
         """Returns the tree's topology in an equivalently structure
@@ -124,6 +604,11 @@ class TreeHandler:
                 >>> branchDataSize([[a, b, c], [x, y]])
                 >>> tree {1; 1}
         """
+        if isinstance(tree, DataTree[object]):
+            shape = TreeHandler.treeShape(TreeHandler.fingerprint(tree))
+            if shape is not None and shape[1] > 1:
+                return th.list_to_tree(TreeHandler.__shapeSizes(shape[0]))
+
         def __listBranchSize(tree):
             if isinstance(tree, DataTree[object]):
                 tree = th.tree_to_list(tree, lambda x: x[0]) 
@@ -0,0 +1,146 @@
+"""A local mirror of image libraries that live on network shares
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from prewarm import WORKERS, prewarm
+
+LIMIT = 4 << 30 # bytes kept in the cache before the least recently used go
+TEMP_PREFIX = ".partial-"
+
+class MirrorCache(object):
+    """Copies source images into a local, size limited cache directory
+
+    Args:
+        root (str): the cache directory, created if missing
+        limit (int): the size in bytes the cache is trimmed to
+    """
+    def __init__(self, root, limit=LIMIT):
+        self.root = root
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.copied = 0
+        self.evicted = 0
+
+    def entryPath(self, source, size, mtime):
+        """Returns the cached path of a source with a given size and mtime"""
+        source = os.path.normcase(os.path.abspath(source))
+        key = hashlib.sha1("{}|{}|{}".format(
+            source, size, int(mtime * 1000)).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key[:2],
+                            key + os.path.splitext(source)[1])
+
+    def fetch(self, source):
+        """Returns the local copy of source, copying it on a miss
+
+        Args:
+            source (str): the path to the source image
+        Returns:
+            (local path, bytes copied)
+        """
+        st = os.stat(source)
+        local = self.entryPath(source, st.st_size, st.st_mtime)
+        if os.path.exists(local):
+            try:
+                os.utime(local, None)
+            except OSError:
+                pass
+            with self.lock:
+                self.hits += 1
+            return local, 0
+        folder = os.path.dirname(local)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        fd, partial = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                with open(source, "rb") as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+            try:
+                os.rename(partial, local)
+            except OSError:
+                # another instance renamed the same entry into place first
+                if not os.path.exists(local):
+                    raise
+                os.remove(partial)
+        except:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        with self.lock:
+            self.misses += 1
+            self.copied += st.st_size
+        return local, st.st_size
+
+    def fetchAll(self, sources, workers=WORKERS):
+        """Fetches the unique sources on a bounded pool of threads
+
+        Args:
+            sources (iterable of str): the paths to the source images
+            workers (int): the maximum number of concurrent copies
+        Returns:
+            dict of source -> local path, sources that cannot be copied
+            map to themselves
+        """
+        local = {}
+
+        def read(source):
+            path, size = self.fetch(source)
+            with self.lock:
+                local[source] = path
+            return size
+
+        sources = set(sources)
+        prewarm(sources, workers, read)
+        for source in sources:
+            local.setdefault(source, source)
+        return local
+
+    def trim(self, keep=()):
+        """Removes the least recently used entries above the size limit
+
+        Args:
+            keep (iterable of str): local paths in use, never removed
+        Returns:
+            the number of entries removed
+        """
+        keep = set(os.path.normcase(p) for p in keep)
+        entries = []
+        total = 0
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                total += st.st_size
+                if os.path.normcase(path) not in keep:
+                    entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue # in use by another instance
+            total -= size
+            removed += 1
+        with self.lock:
+            self.evicted += removed
+        return removed
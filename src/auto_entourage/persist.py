@@ -0,0 +1,42 @@
+"""Compact serialization of the entourage state kept in a Rhino document
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import base64
+import json
+import zlib
+
+FORMAT_VERSION = 1
+
+def internPaths(paths):
+    """Returns (table, indices) so that paths[i] == table[indices[i]]"""
+    table, lookup, indices = [], {}, []
+    for path in paths:
+        if path not in lookup:
+            lookup[path] = len(table)
+            table.append(path)
+        indices.append(lookup[path])
+    return table, indices
+
+def packState(state):
+    """Returns the state (a dict of JSON types) as a compact string"""
+    state = dict(state, version=FORMAT_VERSION)
+    text = json.dumps(state, separators=(",", ":"))
+    return base64.b64encode(zlib.compress(text.encode("utf-8"))).decode(
+        "ascii")
+
+def unpackState(text):
+    """Returns the state packed by packState, or None if text is missing,
+    corrupt or of another format version
+    """
+    if not text:
+        return None
+    try:
+        state = json.loads(zlib.decompress(base64.b64decode(text)).decode(
+            "utf-8"))
+    except (ValueError, TypeError, zlib.error):
+        return None
+    if not isinstance(state, dict) or state.get("version") != FORMAT_VERSION:
+        return None
+    return state
@@ -0,0 +1,169 @@
+"""Headless planning of entourage placements
+
+Chooses an image for every anchor, scales it and orients it to a camera,
+without Rhino. The result is a columnar placement plan that can be saved
+as JSON, cached between sessions, and placed in bulk by the component.
+Images are chosen as by the component (see sampling), so a plan matches
+what a load with the same inputs would place.
+
+Usage:
+    python planner.py anchors.csv images/ --height 1.8 --seed 0
+        --direction 0 1 [--eye x y] [-o plan.json]
+where anchors.csv holds one x,y[,z] anchor per line.
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import argparse
+import json
+import math
+import os
+import struct
+
+from billboard import anchorYaws, yawVectors
+from sampling import CounterRandom, anchorKey
+
+PLAN_VERSION = 1
+
+def pngSize(path):
+    """Returns the (width, height) of a PNG from its header"""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        raise ValueError("{} is not a PNG".format(path))
+    return struct.unpack(">II", header[16:24])
+
+def listImages(folder):
+    """Returns the sorted paths of the PNGs in a folder, as getFiles in the
+    component"""
+    if not folder.endswith(os.sep):
+        folder += os.sep
+    return [folder + f for f in sorted(os.listdir(folder))
+            if f.endswith(".png")]
+
+def planPlacements(anchors, files, sizes, heights, seed, direction=None,
+                   eye=None, keys=None):
+    """Returns the placement plan of entourages
+
+    Frames are vertical: their y axis is the world Z axis, and their x
+    axis is horizontal, facing the camera direction or the eye point.
+
+    Args:
+        anchors (list of (float, float, float)): the anchor points
+        files (list of str): the image library
+        sizes (list of (int, int)): the pixel size of every image
+        heights (list of float): the target height of every anchor
+        seed (int): random seed of the image choice
+        direction ((float, float)): the camera direction on the XY plane
+        eye ((float, float)): (Optional) the point to face instead
+        keys (list of (str, int)): (Optional) the tree key of every anchor
+    Returns:
+        a dict of columns, one item per anchor
+    """
+    images = [CounterRandom(anchorKey(seed, x, y, z)).randrange(len(files))
+              for x, y, z in anchors]
+    return layoutPlan(anchors, files, images, sizes, heights, direction, eye,
+                      keys)
+
+def layoutPlan(anchors, files, images, sizes, heights, direction=None,
+               eye=None, keys=None):
+    """Returns the placement plan of entourages whose images are chosen
+
+    Args:
+        anchors (list of (float, float, float)): the anchor points
+        files (list of str): the image library
+        images (list of int): the index in files of every anchor's image
+        sizes (list of (int, int)): the pixel size of every file
+        heights (list of float): the target height of every anchor
+        direction ((float, float)): the camera direction on the XY plane
+        eye ((float, float)): (Optional) the point to face instead
+        keys (list of (str, int)): (Optional) the tree key of every anchor
+    """
+    widths = [float(sizes[i][0]) / sizes[i][1] * h
+              for i, h in zip(images, heights)]
+    plan = {"version": PLAN_VERSION, "files": list(files),
+            "keys": keys or [["{0}", i] for i in range(len(anchors))],
+            "anchor": [c for a in anchors for c in a], "image": images,
+            "width": widths, "height": list(heights)}
+    return facePlan(plan, direction, eye)
+
+def facePlan(plan, direction=None, eye=None, yaws=None):
+    """Turns every item of a plan toward a camera direction or eye point
+
+    Updates the yaw, origin and x axis columns in place.
+
+    Args:
+        plan (dict): the columns made by layoutPlan
+        direction ((float, float)): the camera direction on the XY plane
+        eye ((float, float)): (Optional) the point to face instead
+        yaws (list of float): (Optional) the yaw of every item instead
+    Returns:
+        the plan
+    """
+    xyz = plan["anchor"]
+    xs, ys = xyz[0::3], xyz[1::3]
+    if yaws is not None:
+        yaws = list(yaws)
+    elif eye is not None:
+        yaws = anchorYaws(xs, ys, eye[0], eye[1])
+    else:
+        yaws = [math.degrees(math.atan2(direction[1], direction[0]))]*len(xs)
+    origin, xAxis = [], []
+    for x, y, z, (dx, dy, _), w in zip(xs, ys, xyz[2::3], yawVectors(yaws),
+                                       plan["width"]):
+        ax, ay = -dy, dx # the facing direction turned 90 degrees
+        origin += [x - 0.5*ax*w, y - 0.5*ay*w, z]
+        xAxis += [ax, ay]
+    plan.update(origin=origin, xAxis=xAxis, yaw=yaws,
+                direction=(list(direction) if eye is None and
+                           direction is not None else None),
+                eye=list(eye) if eye is not None else None)
+    return plan
+
+def savePlan(plan, path):
+    with open(path, "w") as f:
+        json.dump(plan, f, separators=(",", ":"))
+
+def loadPlan(path):
+    """Returns the plan saved in path
+
+    Raises:
+        ValueError: if the file is not a plan of this version
+    """
+    with open(path) as f:
+        plan = json.load(f)
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise ValueError("{} is not a placement plan".format(path))
+    return plan
+
+def readAnchors(path):
+    """Returns the x,y[,z] anchors of a CSV file"""
+    anchors = []
+    with open(path) as f:
+        for line in f:
+            values = [float(v) for v in line.replace(",", " ").split()]
+            if values:
+                anchors.append(tuple(values + [0.0])[:3])
+    return anchors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("anchors", help="CSV file of x,y[,z] anchors")
+    parser.add_argument("images", help="folder of trimmed PNGs")
+    parser.add_argument("--height", type=float, default=1.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--direction", type=float, nargs=2, default=(0, 1))
+    parser.add_argument("--eye", type=float, nargs=2)
+    parser.add_argument("-o", "--out", default="plan.json")
+    args = parser.parse_args()
+    anchors = readAnchors(args.anchors)
+    files = listImages(args.images)
+    plan = planPlacements(anchors, files, [pngSize(f) for f in files],
+                          [args.height]*len(anchors), args.seed,
+                          args.direction, args.eye)
+    savePlan(plan, args.out)
+    print("Planned {} entourages from {} images to {}".format(
+        len(anchors), len(files), args.out))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Geometry for drawing entourages through a display conduit
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+from array import array
+
+from export import groupByImage
+
+QUAD_UVS = (0, 0, 1, 0, 1, 1, 0, 1) # texture coordinates of the corners
+
+def quadVertices(plan, indices):
+    """Returns the corners of the quads of some items of a plan
+
+    Corners go from the origin along the x axis by the width, then up by
+    the height, so every quad takes 12 floats.
+
+    Args:
+        plan (dict): the columns made by planner.planPlacements
+        indices (list of int): the items
+    Returns:
+        array of float (x, y, z) per corner
+    """
+    origin, xAxis = plan["origin"], plan["xAxis"]
+    widths, heights = plan["width"], plan["height"]
+    xs = array("f", [origin[3*i] for i in indices])
+    ys = array("f", [origin[3*i+1] for i in indices])
+    zs = array("f", [origin[3*i+2] for i in indices])
+    ws = [widths[i] for i in indices]
+    xe = array("f", [x + xAxis[2*i]*w for x, i, w in zip(xs, indices, ws)])
+    ye = array("f", [y + xAxis[2*i+1]*w for y, i, w in zip(ys, indices, ws)])
+    ze = array("f", [z + heights[i] for z, i in zip(zs, indices)])
+    vertices = array("f", [0.0]) * (12*len(indices))
+    for offset, column in enumerate((xs, ys, zs, xe, ye, zs,
+                                     xe, ye, ze, xs, ys, ze)):
+        vertices[offset::12] = column
+    return vertices
+
+def quadBounds(groups):
+    """Returns the (min, max) corners of the box around the quads of
+    previewGroups, or None if there are none"""
+    lows, highs = [], []
+    for _, vertices, _ in groups:
+        columns = [vertices[i::3] for i in range(3)]
+        lows.append([min(c) for c in columns])
+        highs.append([max(c) for c in columns])
+    if not lows:
+        return None
+    return (tuple(min(c) for c in zip(*lows)),
+            tuple(max(c) for c in zip(*highs)))
+
+def previewGroups(plan):
+    """Returns the quads of a plan grouped by image
+
+    Returns:
+        list of (file, vertices, count) for the images in use
+    """
+    return [(plan["files"][image], quadVertices(plan, indices), len(indices))
+            for image, indices in enumerate(groupByImage(plan)) if indices]
@@ -0,0 +1,61 @@
+"""Concurrent reads that warm the OS page cache before frames are created
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import threading
+import time
+
+WORKERS = 8
+BLOCK_SIZE = 1 << 20
+
+def readAll(path, blockSize=BLOCK_SIZE):
+    """Reads a file to the end and returns its size in bytes"""
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(blockSize)
+            if not block:
+                return size
+            size += len(block)
+
+def prewarm(paths, workers=WORKERS, read=readAll):
+    """Reads the unique paths on a bounded pool of threads
+
+    Args:
+        paths (iterable of str): the files to read, duplicates are read once
+        workers (int): the maximum number of concurrent reads
+        read (callable): reads a path and returns the bytes read
+    Returns:
+        (files, bytes, seconds, failed) read
+    """
+    pending = sorted(set(paths))
+    lock = threading.Lock()
+    totals = {"files": 0, "bytes": 0, "failed": 0}
+
+    def work():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                path = pending.pop()
+            try:
+                size = read(path)
+            except (IOError, OSError):
+                with lock:
+                    totals["failed"] += 1
+                continue
+            with lock:
+                totals["files"] += 1
+                totals["bytes"] += size
+
+    start = time.time()
+    threads = [threading.Thread(target=work)
+               for _ in range(min(workers, len(pending)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return (totals["files"], totals["bytes"], time.time() - start,
+            totals["failed"])
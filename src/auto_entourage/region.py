@@ -0,0 +1,103 @@
+"""Blue-noise anchor points for populating regions
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import math
+import random
+
+ATTEMPTS = 16 # candidates tried around an active sample before retiring it
+
+def pointInLoops(x, y, loops):
+    """Returns whether (x, y) is inside the loops by the even-odd rule
+
+    Args:
+        loops (list): closed polygons as lists of (x, y), holes included
+    """
+    inside = False
+    for loop in loops:
+        x0, y0 = loop[-1]
+        for x1, y1 in loop:
+            if (y1 > y) != (y0 > y):
+                if x < x0 + (y - y0)*(x1 - x0)/(y1 - y0):
+                    inside = not inside
+            x0, y0 = x1, y1
+    return inside
+
+def poissonDisk(loops, spacing, seed, attempts=ATTEMPTS):
+    """Returns points inside the loops at least spacing apart
+
+    Args:
+        loops (list): closed polygons as lists of (x, y), holes included
+        spacing (float): the minimum distance between two points
+        seed (int): random seed, the same seed gives the same points
+        attempts (int): candidates per active point (k in Bridson's paper)
+    Returns:
+        list of (x, y)
+    """
+    rnd = random.Random(seed)
+    xs = [x for loop in loops for x, y in loop]
+    ys = [y for loop in loops for x, y in loop]
+    if not xs or spacing <= 0:
+        return []
+    minX, minY = min(xs), min(ys)
+    cell = spacing / math.sqrt(2)
+    cols = int((max(xs) - minX) / cell) + 1
+    rows = int((max(ys) - minY) / cell) + 1
+    maxX, maxY = minX + cols*cell, minY + rows*cell
+    # the grid is padded by two cells so neighbors need no bounds checks
+    width = cols + 4
+    grid = [-1]*(width*(rows + 4))
+    neighbors = [j*width + i for j in range(-2, 3) for i in range(-2, 3)
+                 if abs(i) + abs(j) < 4]
+    samples = []
+    active = []
+    r2 = spacing*spacing
+
+    def cellOf(x, y):
+        return (int((y - minY) / cell) + 2)*width + int((x - minX) / cell) + 2
+
+    def fits(x, y):
+        if not (minX <= x < maxX and minY <= y < maxY):
+            return False
+        base = cellOf(x, y)
+        for d in neighbors:
+            s = grid[base + d]
+            if s >= 0:
+                sx, sy = samples[s]
+                if (sx - x)*(sx - x) + (sy - y)*(sy - y) < r2:
+                    return False
+        return pointInLoops(x, y, loops)
+
+    def add(x, y):
+        grid[cellOf(x, y)] = len(samples)
+        active.append(len(samples))
+        samples.append((x, y))
+
+    for loop in loops:
+        lx, ly = [x for x, y in loop], [y for x, y in loop]
+        for _ in range(attempts):
+            x = rnd.uniform(min(lx), max(lx))
+            y = rnd.uniform(min(ly), max(ly))
+            if fits(x, y):
+                add(x, y)
+                break
+
+    # candidates are spread evenly on the inner rim of the annulus from a
+    # random start angle (M. Roberts' variant), so far fewer are rejected
+    step = 2*math.pi / attempts
+    rim = spacing*(1 + 1e-7)
+    while active:
+        k = rnd.randrange(len(active))
+        sx, sy = samples[active[k]]
+        start = rnd.random()*2*math.pi
+        for j in range(attempts):
+            angle = start + j*step
+            x, y = sx + rim*math.cos(angle), sy + rim*math.sin(angle)
+            if fits(x, y):
+                add(x, y)
+                break
+        else:
+            active[k] = active[-1]
+            active.pop()
+    return samples
@@ -0,0 +1,718 @@
+"""CPython stand-ins for the Rhino and Grasshopper APIs used by Auto Entourage
+
+Implements just enough of Grasshopper.DataTree, GH_Path and
+ghpythonlib.treehelpers (with their GhPython semantics) for the modules in
+this folder to be imported and exercised outside Rhino:
+    >>> import rhinosim
+    >>> rhinosim.install()
+    >>> from ghutil import TreeHandler
+
+It also simulates a Rhino document (scriptcontext, rhinoscriptsyntax and
+the Rhino.Geometry types the component uses), counting every call into
+it in CALLS, so that the component script itself can be run with runScript.
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import bisect
+import collections
+import math
+import struct
+import sys
+import types
+import uuid
+import zlib
+
+CALLS = collections.Counter()
+
+def counted(func):
+    """Counts the calls to a stand-in of a document API in CALLS"""
+    name = getattr(func, "__qualname__", func.__name__)
+    def wrapper(*args, **kwargs):
+        CALLS[name] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+def isIterable(item):
+    """Mirrors hasattr(item, '__iter__') under IronPython, where str has
+    no __iter__"""
+    return hasattr(item, "__iter__") and not isinstance(item, str)
+
+class GH_Path(object):
+    """Stand-in for Grasshopper.Kernel.Data.GH_Path"""
+    def __init__(self, *indices):
+        if len(indices) == 1 and isIterable(indices[0]):
+            indices = indices[0]
+        self.Indices = tuple(indices)
+
+    @property
+    def Length(self):
+        return len(self.Indices)
+
+    def __getitem__(self, i):
+        return self.Indices[i]
+
+    def __eq__(self, other):
+        return self.Indices == other.Indices
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.Indices < other.Indices
+
+    def __hash__(self):
+        return hash(self.Indices)
+
+    def __str__(self):
+        return "{" + ";".join(str(i) for i in self.Indices) + "}"
+
+    __repr__ = __str__
+
+class Branch(list):
+    """Stand-in for System.Collections.Generic.List"""
+    @property
+    def Count(self):
+        return len(self)
+
+class DataTree(object):
+    """Stand-in for Grasshopper.DataTree[object]
+
+    Branches are kept sorted by path, as GH_Structure does.
+    """
+    def __init__(self):
+        self.paths = []
+        self.branches = {}
+
+    @property
+    def BranchCount(self):
+        return len(self.paths)
+
+    def Path(self, i):
+        return self.paths[i]
+
+    def Branch(self, i):
+        return self.branches[self.paths[i]]
+
+    def EnsurePath(self, path):
+        if path not in self.branches:
+            bisect.insort(self.paths, path)
+            self.branches[path] = Branch()
+        return self.branches[path]
+
+    def Add(self, item, path=None):
+        self.EnsurePath(GH_Path(0) if path is None else path).append(item)
+
+    def AddRange(self, items, path):
+        self.EnsurePath(path).extend(items)
+
+    def Insert(self, item, path, index):
+        branch = self.EnsurePath(path)
+        if index > len(branch):
+            branch.extend([None]*(index - len(branch)))
+        branch.insert(index, item)
+
+    def AllData(self):
+        return Branch(item for p in self.paths for item in self.branches[p])
+
+    def __eq__(self, other):
+        return (self.paths == other.paths and
+                all(self.branches[p] == other.branches[p] for p in self.paths))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "DataTree({})".format(", ".join(
+            "{}: {}".format(p, list(self.branches[p])) for p in self.paths))
+
+class _Generic(object):
+    """Makes DataTree[object] return the DataTree class"""
+    def __init__(self, cls):
+        self.cls = cls
+
+    def __getitem__(self, typ):
+        return self.cls
+
+    def __call__(self, *args):
+        return self.cls(*args)
+
+def tree_to_list(input, retrieve_base=lambda x: x[0]):
+    """ghpythonlib.treehelpers.tree_to_list"""
+    def extend_at(path, index, simple_input, rest_list):
+        target = path[index]
+        if len(rest_list) <= target:
+            rest_list.extend([None]*(target - len(rest_list) + 1))
+        if index == path.Length - 1:
+            rest_list[target] = list(simple_input)
+        else:
+            if rest_list[target] is None:
+                rest_list[target] = []
+            extend_at(path, index + 1, simple_input, rest_list[target])
+    all = []
+    for i in range(input.BranchCount):
+        extend_at(input.Path(i), 0, input.Branch(i), all)
+    return retrieve_base(all)
+
+def list_to_tree(input, none_and_holes=True, source=[0]):
+    """ghpythonlib.treehelpers.list_to_tree"""
+    def proc(input, tree, track):
+        path = GH_Path(track)
+        if len(input) == 0 and none_and_holes:
+            tree.EnsurePath(path)
+            return
+        for i, item in enumerate(input):
+            if isIterable(item):
+                track.append(i)
+                proc(item, tree, track)
+                track.pop()
+            else:
+                if none_and_holes:
+                    tree.Insert(item, path, i)
+                elif item is not None:
+                    tree.Add(item, path)
+    if input is not None:
+        t = DataTree()
+        proc(input, t, source[:])
+        return t
+
+def module(name, **attrs):
+    """Returns a new module registered in sys.modules"""
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    parent, _, child = name.rpartition(".")
+    if parent in sys.modules:
+        setattr(sys.modules[parent], child, mod)
+    return mod
+
+class _Array(object):
+    """Makes System.Array[int](values) return a tuple"""
+    def __getitem__(self, typ):
+        return tuple
+
+class Event(object):
+    """Stand-in for a .NET event supporting += and -="""
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self, *args):
+        for handler in list(self.handlers):
+            handler(*args)
+
+class Point3d(object):
+    """Stand-in for Rhino.Geometry.Point3d"""
+    __slots__ = ("X", "Y", "Z")
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.X, self.Y, self.Z = float(x), float(y), float(z)
+
+    def __add__(self, v):
+        return Point3d(self.X + v.X, self.Y + v.Y, self.Z + v.Z)
+
+    def __sub__(self, other):
+        """point - point is a vector, point - vector a point"""
+        cls = type(self)
+        if cls is Point3d and type(other) is Point3d:
+            cls = Vector3d
+        return cls(self.X - other.X, self.Y - other.Y, self.Z - other.Z)
+
+    def __eq__(self, other):
+        return (isinstance(other, Point3d) and
+                (self.X, self.Y, self.Z) == (other.X, other.Y, other.Z))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.X, self.Y, self.Z))
+
+    def __repr__(self):
+        return "{}({}, {}, {})".format(type(self).__name__,
+                                       self.X, self.Y, self.Z)
+
+class Vector3d(Point3d):
+    """Stand-in for Rhino.Geometry.Vector3d"""
+    __slots__ = ()
+    def __mul__(self, s):
+        return Vector3d(self.X * s, self.Y * s, self.Z * s)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vector3d(-self.X, -self.Y, -self.Z)
+
+    @property
+    def Length(self):
+        return math.sqrt(self.X**2 + self.Y**2 + self.Z**2)
+
+    def Unitize(self):
+        length = self.Length
+        if length == 0:
+            return False
+        self.X, self.Y, self.Z = self.X/length, self.Y/length, self.Z/length
+        return True
+
+    @staticmethod
+    def Multiply(a, b):
+        return a.X*b.X + a.Y*b.Y + a.Z*b.Z
+
+    @staticmethod
+    def CrossProduct(a, b):
+        return Vector3d(a.Y*b.Z - a.Z*b.Y, a.Z*b.X - a.X*b.Z,
+                        a.X*b.Y - a.Y*b.X)
+
+    @staticmethod
+    def VectorAngle(a, b):
+        cos = Vector3d.Multiply(a, b) / (a.Length * b.Length)
+        return math.acos(max(-1.0, min(1.0, cos)))
+
+def rotateZ(v, degrees, cls=None):
+    """Returns v rotated about the Z axis"""
+    a = math.radians(degrees)
+    c, s = math.cos(a), math.sin(a)
+    return (cls or type(v))(v.X*c - v.Y*s, v.X*s + v.Y*c, v.Z)
+
+class Plane(object):
+    def __init__(self, origin, xAxis, yAxis):
+        self.Origin, self.XAxis, self.YAxis = origin, xAxis, yAxis
+
+class Interval(object):
+    def __init__(self, t0, t1):
+        self.T0, self.T1 = t0, t1
+
+class PlaneSurface(object):
+    def __init__(self, plane, u, v):
+        self.plane, self.u, self.v = plane, u, v
+
+class _Items(list):
+    """Stand-in for the vertex, face and texture coordinate lists of a
+    Rhino.Geometry.Mesh"""
+    def AddVertices(self, items):
+        self.extend(items)
+
+    AddFaces = AddRange = AddVertices
+
+    def SetVertex(self, index, x, y, z):
+        self[index] = (x, y, z)
+        return True
+
+class Mesh(object):
+    """Stand-in for Rhino.Geometry.Mesh"""
+    def __init__(self):
+        self.Vertices, self.Faces = _Items(), _Items()
+        self.TextureCoordinates = _Items()
+
+    def DuplicateMesh(self):
+        mesh = Mesh()
+        mesh.Vertices.extend(self.Vertices)
+        mesh.Faces.extend(self.Faces)
+        mesh.TextureCoordinates.extend(self.TextureCoordinates)
+        return mesh
+
+class BoundingBox(object):
+    def __init__(self, min, max):
+        self.Min, self.Max = min, max
+
+class Box(object):
+    def __init__(self, boundingBox):
+        self.BoundingBox = boundingBox
+
+class DisplayConduit(object):
+    """Stand-in for Rhino.Display.DisplayConduit, counting draws in
+    CALLS when the active view is drawn with draw()"""
+    conduits = []
+
+    def __init__(self):
+        self.Enabled = False
+
+    def __setattr__(self, name, value):
+        if name == "Enabled":
+            if value and self not in DisplayConduit.conduits:
+                DisplayConduit.conduits.append(self)
+            elif not value and self in DisplayConduit.conduits:
+                DisplayConduit.conduits.remove(self)
+        object.__setattr__(self, name, value)
+
+class DisplayPipeline(object):
+    @counted
+    def DrawMeshShaded(self, mesh, material):
+        pass
+
+class DisplayMaterial(object):
+    def SetBitmapTexture(self, fileName, front):
+        self.bitmap = fileName
+
+    def SetTransparencyTexture(self, fileName, front):
+        self.transparency = fileName
+
+def draw():
+    """Draws the enabled conduits once, returning the bounding boxes they
+    include"""
+    boxes = []
+    e = types.SimpleNamespace(Display=DisplayPipeline(),
+                              IncludeBoundingBox=boxes.append)
+    for conduit in DisplayConduit.conduits:
+        conduit.CalculateBoundingBox(e)
+        conduit.PostDrawObjects(e)
+    return boxes
+
+class Transform(object):
+    """Stand-in for Rhino.Geometry.Transform, rotations about Z only"""
+    def __init__(self, angle, center):
+        self.angle, self.center = angle, center
+
+    @staticmethod
+    def Rotation(angle, axis, center):
+        return Transform(math.degrees(angle), center)
+
+class ViewTransform(object):
+    """A 4x4 matrix indexed as xform[i, j]"""
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getitem__(self, ij):
+        return self.rows[ij[0]][ij[1]]
+
+class Viewport(object):
+    """Stand-in for the active RhinoViewport
+
+    clip is the world to clip matrix, identity unless a benchmark sets one.
+    """
+    def __init__(self):
+        self.CameraDirection = Vector3d(0, 1, 0)
+        self.CameraLocation = Point3d(0, -100, 10)
+        self.Size = types.SimpleNamespace(Height=1080)
+        self.clip = [[float(i == j) for j in range(4)] for i in range(4)]
+
+    @counted
+    def GetTransform(self, source, target):
+        return ViewTransform(self.clip)
+
+class ViewTable(object):
+    """Stand-in for RhinoDoc.Views"""
+    def __init__(self):
+        self.ActiveView = types.SimpleNamespace(ActiveViewport=Viewport())
+
+    @counted
+    def Redraw(self):
+        pass
+
+class Component(object):
+    """Stand-in for ghenv.Component"""
+    def __init__(self):
+        self.Message = None
+
+    def OnDisplayExpired(self, redraw):
+        pass
+
+class DocObject(object):
+    def __init__(self, layer, plane, materials, materialIndex=-1, mesh=None):
+        self.Id = uuid.uuid4()
+        self.layer = layer
+        self.plane = plane
+        self.materials = materials
+        self.Attributes = types.SimpleNamespace(MaterialIndex=materialIndex)
+        self.MeshGeometry = mesh
+
+    @property
+    def path(self):
+        """The texture of a picture frame, or None"""
+        index = self.Attributes.MaterialIndex
+        if index < 0:
+            return None
+        return self.materials.textures[index]
+
+class Material(object):
+    """Stand-in for Rhino.DocObjects.Material with a bitmap and a
+    transparency texture"""
+    def __init__(self, fileName=None, transparency=None):
+        self.fileName = fileName
+        self.transparency = transparency
+
+    @counted
+    def SetBitmapTexture(self, fileName):
+        self.fileName = fileName
+        return True
+
+    @counted
+    def SetTransparencyTexture(self, fileName):
+        self.transparency = fileName
+        return True
+
+    def GetBitmapTexture(self):
+        if self.fileName is None:
+            return None
+        return types.SimpleNamespace(FileName=self.fileName)
+
+class MaterialTable(object):
+    """Stand-in for RhinoDoc.Materials, one material per picture frame
+
+    A picture frame's image is both its bitmap and its transparency
+    texture.
+    """
+    def __init__(self):
+        self.textures = []
+        self.transparencies = []
+
+    def __len__(self):
+        return len(self.textures)
+
+    def add(self, fileName):
+        self.textures.append(fileName)
+        self.transparencies.append(fileName)
+        return len(self.textures) - 1
+
+    def __getitem__(self, index):
+        return Material(self.textures[index], self.transparencies[index])
+
+    @counted
+    def Add(self):
+        return self.add(None)
+
+    @counted
+    def Modify(self, material, index, quiet):
+        self.textures[index] = material.fileName
+        self.transparencies[index] = material.transparency
+        return True
+
+class ObjectTable(object):
+    """Stand-in for RhinoDoc.Objects"""
+    def __init__(self, doc):
+        self.doc = doc
+        self.objects = {}
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add(self, plane, materialIndex=-1):
+        obj = DocObject(self.doc.Layers.current, plane, self.doc.Materials,
+                        materialIndex)
+        self.objects[obj.Id] = obj
+        return obj.Id
+
+    @counted
+    def AddPictureFrame(self, plane, path, asMesh, width, height,
+                        selfIllumination, embedBitmap):
+        return self.add(plane, self.doc.Materials.add(path))
+
+    @counted
+    def AddSurface(self, surface):
+        return self.add(surface.plane)
+
+    @counted
+    def AddMesh(self, mesh, attributes):
+        obj = DocObject(attributes.LayerIndex, None, self.doc.Materials,
+                        attributes.MaterialIndex, mesh)
+        self.objects[obj.Id] = obj
+        return obj.Id
+
+    @counted
+    def Replace(self, id, mesh):
+        obj = self.objects.get(id)
+        if obj is None:
+            return False
+        obj.MeshGeometry = mesh
+        return True
+
+    @counted
+    def Delete(self, ids, quiet):
+        if not isIterable(ids):
+            return self.objects.pop(ids, None) is not None
+        return sum(self.objects.pop(i, None) is not None for i in ids)
+
+    @counted
+    def Transform(self, id, xform, deleteOriginal):
+        obj = self.objects.get(id)
+        if obj is None:
+            return uuid.UUID(int=0)
+        plane, c = obj.plane, xform.center
+        origin = rotateZ(plane.Origin - c, xform.angle, Vector3d)
+        obj.plane = Plane(Point3d(c.X + origin.X, c.Y + origin.Y,
+                                  c.Z + origin.Z),
+                          rotateZ(plane.XAxis, xform.angle), plane.YAxis)
+        return id
+
+    @counted
+    def FindId(self, id):
+        return self.objects.get(id)
+
+    @counted
+    def FindByLayer(self, name):
+        layer = self.doc.Layers.FindName(name)
+        if layer is None:
+            return []
+        return [o for o in self.objects.values() if o.layer == layer.Index]
+
+class LayerTable(object):
+    """Stand-in for RhinoDoc.Layers"""
+    def __init__(self):
+        self.names = ["Default"]
+        self.current = 0
+
+    @counted
+    def FindName(self, name):
+        if name not in self.names:
+            return None
+        return types.SimpleNamespace(Index=self.names.index(name), Name=name)
+
+    @counted
+    def Add(self, name, color):
+        self.names.append(name)
+        return len(self.names) - 1
+
+    @counted
+    def SetCurrentLayerIndex(self, index, quiet):
+        self.current = index
+        return True
+
+    @counted
+    def Delete(self, layer, quiet):
+        if layer is None or layer.Index == 0:
+            return False
+        self.names[layer.Index] = None
+        return True
+
+class StringTable(object):
+    """Stand-in for RhinoDoc.Strings"""
+    def __init__(self):
+        self.values = {}
+
+    @counted
+    def SetString(self, section, entry, value):
+        self.values[(section, entry)] = value
+
+    @counted
+    def GetValue(self, section, entry):
+        return self.values.get((section, entry))
+
+class Document(object):
+    """Stand-in for a RhinoDoc"""
+    def __init__(self):
+        self.Objects = ObjectTable(self)
+        self.Layers = LayerTable()
+        self.Strings = StringTable()
+        self.Materials = MaterialTable()
+        self.Views = ViewTable()
+        self.ModelAbsoluteTolerance = 0.001
+        self.ModelAngleToleranceRadians = math.radians(1)
+
+    @property
+    def ActiveDoc(self):
+        return self
+
+    def CreateDefaultAttributes(self):
+        return types.SimpleNamespace(LayerIndex=self.Layers.current,
+                                     MaterialIndex=-1, MaterialSource=None)
+
+@counted
+def EnableRedraw(enable=True):
+    return True
+
+@counted
+def VectorRotate(vector, angle, axis):
+    return rotateZ(vector, angle)
+
+@counted
+def MoveObject(id, translation):
+    obj = sys.modules["scriptcontext"].doc.Objects.objects.get(id)
+    if obj is not None:
+        obj.plane = Plane(obj.plane.Origin + translation, obj.plane.XAxis,
+                          obj.plane.YAxis)
+    return id
+
+@counted
+def RotateObject(id, center, angle):
+    doc = sys.modules["scriptcontext"].doc
+    return doc.Objects.Transform(id, Transform(angle, center), True)
+
+def writePng(path, width, height):
+    """Writes a blank grayscale PNG of the given size"""
+    def chunk(kind, data):
+        body = kind + data
+        return (struct.pack(">I", len(data)) + body +
+                struct.pack(">I", zlib.crc32(body) & 0xffffffff))
+    rows = b"".join(b"\0" + b"\0"*width for _ in range(height))
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", struct.pack(">IIBBBBB", width, height,
+                                           8, 0, 0, 0, 0)) +
+                chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+class Bitmap(object):
+    """Stand-in for System.Drawing.Bitmap, reading sizes from PNG headers"""
+    def __init__(self, source, width, height):
+        self.Width, self.Height = width, height
+
+    @staticmethod
+    @counted
+    def FromFile(path):
+        with open(path, "rb") as f:
+            width, height = struct.unpack(">II", f.read(24)[16:24])
+        return Bitmap(None, width, height)
+
+    def Save(self, path, format):
+        writePng(path, self.Width, self.Height)
+
+    def Dispose(self):
+        pass
+
+def runScript(path, scope):
+    """Runs a GhPython script with its inputs (and the globals left by
+    earlier runs) in scope, like a component solving once"""
+    with open(path) as f:
+        source = f.read()
+    scope.setdefault("__name__", "__main__")
+    exec(compile(source, path, "exec"), scope)
+    return scope
+
+def newDocument():
+    """Replaces the simulated document with an empty one and returns it"""
+    doc = Document()
+    sys.modules["scriptcontext"].doc = doc
+    sys.modules["Rhino.RhinoDoc"].ActiveDoc = doc
+    return doc
+
+def install():
+    """Registers the stand-in modules in sys.modules"""
+    doc = Document()
+    drawing = module("System.Drawing", Bitmap=Bitmap,
+                     Color=types.SimpleNamespace(Black=(0, 0, 0)))
+    module("System.Drawing.Imaging",
+           ImageFormat=types.SimpleNamespace(Png="png"))
+    module("System", Array=_Array(), Guid=uuid.UUID, Drawing=drawing)
+    module("Grasshopper", DataTree=_Generic(DataTree))
+    module("Grasshopper.Kernel")
+    module("Grasshopper.Kernel.Data", GH_Path=GH_Path)
+    module("ghpythonlib")
+    module("ghpythonlib.treehelpers", tree_to_list=tree_to_list,
+           list_to_tree=list_to_tree)
+    module("ghpythonlib.components")
+    module("Rhino", RhinoApp=types.SimpleNamespace(Idle=Event()))
+    module("Rhino.RhinoDoc", ActiveDoc=doc)
+    module("Rhino.Display",
+           RhinoView=types.SimpleNamespace(Modified=Event()),
+           DisplayConduit=DisplayConduit, DisplayMaterial=DisplayMaterial)
+    module("Rhino.DocObjects", CoordinateSystem=types.SimpleNamespace(
+        World="World", Clip="Clip"), ObjectMaterialSource=types.SimpleNamespace(
+        MaterialFromObject="MaterialFromObject"))
+    module("Rhino.Geometry", Point3d=Point3d, Vector3d=Vector3d, Plane=Plane,
+           Interval=Interval, PlaneSurface=PlaneSurface,
+           Transform=Transform, Mesh=Mesh, BoundingBox=BoundingBox,
+           Box=Box, Point3f=lambda *xyz: tuple(xyz),
+           Point2f=lambda *uv: tuple(uv),
+           MeshFace=lambda *indices: tuple(indices),
+           Curve=type("Curve", (object,), {}))
+    module("rhinoscriptsyntax", EnableRedraw=EnableRedraw,
+           VectorRotate=VectorRotate, MoveObject=MoveObject,
+           RotateObject=RotateObject)
+    module("scriptcontext", doc=doc, sticky={})
+    return doc
@@ -0,0 +1,137 @@
+"""Weighted sampling of images with Walker/Vose alias tables
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import collections
+import fnmatch
+
+TABLE_CACHE_SIZE = 16
+TABLES = collections.OrderedDict()
+MASK64 = (1 << 64) - 1
+GOLDEN64 = 0x9E3779B97F4A7C15
+RESOLUTION = 1e-4 # coordinates closer than this hash alike
+
+def splitmix64(x):
+    """Returns the SplitMix64 output for the state x"""
+    z = (x + GOLDEN64) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def anchorKey(seed, x, y, z=0.0):
+    """Returns a 64-bit key hashed from a seed and anchor coordinates"""
+    key = splitmix64(int(seed) & MASK64)
+    for c in (x, y, z):
+        key = splitmix64(key ^ (int(round(c / RESOLUTION)) & MASK64))
+    return key
+
+class CounterRandom:
+    """Random numbers hashed from a key and a counter
+
+    Has the methods of random.Random used here, so that it can stand in
+    for it in AliasTable.draw.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.counter = 0
+
+    def random(self):
+        self.counter += 1
+        bits = splitmix64((self.key + self.counter * GOLDEN64) & MASK64)
+        return (bits >> 11) * (1.0 / (1 << 53))
+
+    def randrange(self, n):
+        return int(self.random() * n)
+
+class AliasTable:
+    """Draws indices in proportion to their weights (Vose's method)
+    """
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("At least one positive weight is needed")
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0]*n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # whatever is left is 1 up to rounding errors
+
+    def draw(self, rnd):
+        """Returns a random index using rnd, a random.Random"""
+        u = rnd.random() * len(self.prob)
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+def parseRules(rules):
+    """Returns (pattern, weight) pairs from strings like "cyclists:30"
+
+    Args:
+        rules (list of str): a pattern and its weight joined by a colon
+    Raises:
+        ValueError: if a rule is not pattern:weight or its weight is
+            negative
+    """
+    pairs = []
+    for rule in rules:
+        pattern, _, weight = rule.rpartition(":")
+        if not pattern:
+            raise ValueError("Rule {} is not pattern:weight".format(rule))
+        if float(weight) < 0:
+            raise ValueError("Rule {} has a negative weight".format(rule))
+        pairs.append((pattern.strip().lower(), float(weight)))
+    return pairs
+
+def fileWeights(files, folders, rules):
+    """Returns the weight of every file
+
+    A file falls in the category of the first rule whose pattern matches
+    its folder name or its file name. The weight of a category is shared
+    among its files, so the mix does not depend on how many images each
+    category has. Files matching no rule are never drawn.
+
+    Args:
+        files (list of str): the file names
+        folders (list of str): the name of the folder of every file
+        rules (list of (str, float)): patterns and their weights
+    """
+    categories = []
+    for name, folder in zip(files, folders):
+        name, folder = name.lower(), folder.lower()
+        for k, (pattern, _) in enumerate(rules):
+            if (fnmatch.fnmatch(folder, pattern) or
+                fnmatch.fnmatch(name, pattern)):
+                categories.append(k)
+                break
+        else:
+            categories.append(None)
+    sizes = collections.Counter(categories)
+    return [0.0 if k is None else rules[k][1] / sizes[k]
+            for k in categories]
+
+def cachedTable(library, weights):
+    """Returns the alias table of a library, built once per library
+    snapshot and weights
+
+    Args:
+        library (tuple): the items of the library
+        weights (tuple of float): the weight of every item
+    """
+    key = (library, weights)
+    table = TABLES.get(key)
+    if table is None:
+        table = AliasTable(weights)
+        TABLES[key] = table
+        if len(TABLES) > TABLE_CACHE_SIZE:
+            TABLES.popitem(last=False)
+    else:
+        TABLES[key] = TABLES.pop(key)
+    return table
@@ -0,0 +1,119 @@
+"""Diffing of entourage placements between loads
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+def diffEntries(old, new):
+    """Returns the keys to add, move and remove to turn old into new
+
+    An entourage whose image or height changed is removed and added again;
+    one whose anchor changed only is moved.
+
+    Args:
+        old (dict): key -> (guid, path, point, height) of placed entourages
+        new (dict): key -> (path, point, height) of the new assignment
+    Returns:
+        (added, moved, removed) lists of keys
+    """
+    removed = [key for key in old if key not in new]
+    added, moved = [], []
+    for key, (path, point, height) in new.items():
+        entry = old.get(key)
+        if entry is None:
+            added.append(key)
+        elif entry[1] != path or entry[3] != height:
+            removed.append(key)
+            added.append(key)
+        elif entry[2] != point:
+            moved.append(key)
+    return added, moved, removed
+
+def keepImages(old, new):
+    """Returns the new assignment with the images of moved entourages kept
+
+    Images are hashed from the anchor, so a moved anchor gets a new image
+    and would be replaced rather than moved. An entourage whose anchor
+    changed but whose height did not keeps its placed image instead.
+
+    Args:
+        old (dict): key -> (guid, path, point, height) of placed entourages
+        new (dict): key -> (path, point, height) of the new assignment
+    Returns:
+        the new assignment as a new dict
+    """
+    kept = dict(new)
+    for key, (path, point, height) in new.items():
+        entry = old.get(key)
+        if entry is not None and entry[2] != point and entry[3] == height:
+            kept[key] = (entry[1], point, height)
+    return kept
+
+def keepShifted(old, new):
+    """Returns the new assignment with the images of shifted entourages
+    kept
+
+    A moved entourage keeps its image under its key, so inserting an anchor
+    before it would shift it to a key whose hashed image differs. An
+    entourage whose anchor and height are placed under another key keeps
+    that placed image instead.
+
+    Args:
+        old (dict): key -> (guid, path, point, height) of placed entourages
+        new (dict): key -> (path, point, height) of the new assignment
+    Returns:
+        the new assignment as a new dict
+    """
+    placed = {}
+    for key, (guid, path, point, height) in old.items():
+        item = new.get(key)
+        if item is None or item[1] != point:
+            placed.setdefault((point, height), []).append(path)
+    kept = dict(new)
+    for key, (path, point, height) in new.items():
+        entry = old.get(key)
+        if entry is not None and entry[2] == point:
+            continue
+        paths = placed.get((point, height))
+        if paths:
+            kept[key] = (paths.pop(), point, height)
+    return kept
+
+def rekeyEntries(old, new):
+    """Moves placed entourages to the key of an identical new assignment
+
+    Inserting an anchor shifts the keys of those after it. Such entourages
+    keep their image, anchor and height, so they are reused under their
+    new key instead of being replaced.
+
+    Args:
+        old (dict): key -> (guid, path, point, height) of placed entourages
+        new (dict): key -> (path, point, height) of the new assignment
+    Returns:
+        (rekeyed, stale) the entries under their new keys, and the entries
+        that lost their key to another entourage and are to be deleted
+    """
+    rekeyed = {}
+    unmatched = {}
+    for key, entry in old.items():
+        if new.get(key) == entry[1:]:
+            rekeyed[key] = entry
+        else:
+            unmatched.setdefault(entry[1:], []).append(key)
+    claimed = set(rekeyed)
+    for key, item in new.items():
+        if key in rekeyed:
+            continue
+        candidates = unmatched.get(item)
+        if candidates:
+            source = candidates.pop()
+            rekeyed[key] = old[source]
+            claimed.add(source)
+    stale = []
+    for key, entry in old.items():
+        if key in claimed:
+            continue
+        if key in rekeyed:
+            stale.append(entry)
+        else:
+            rekeyed[key] = entry
+    return rekeyed, stale
@@ -0,0 +1,289 @@
+"""Uniform grid spatial hash and overlap resolution for entourages
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import math
+import random
+from region import pointInLoops
+
+DROPPED = -2 # level of detail of entourages left out by resolveOverlaps
+CELL_STRIDE = 1 << 32 # rows per column in the integer cell keys of the resolver
+
+class SpatialHash:
+    """Hashes indexed points into a uniform grid of square cells
+    """
+    def __init__(self, cellSize):
+        self.cellSize = float(cellSize)
+        self.cells = {}
+
+    def cell(self, x, y):
+        """Returns the (column, row) of the cell containing (x, y)"""
+        return (int(math.floor(x / self.cellSize)),
+                int(math.floor(y / self.cellSize)))
+
+    def insert(self, index, x, y):
+        self.cells.setdefault(self.cell(x, y), []).append(index)
+
+    def remove(self, index, x, y):
+        key = self.cell(x, y)
+        bucket = self.cells.get(key)
+        if bucket is not None and index in bucket:
+            bucket.remove(index)
+            if not bucket:
+                del self.cells[key]
+
+    def near(self, x, y, radius):
+        """Returns the indices in all cells within radius of (x, y)
+
+        Candidates still have to be checked for their actual distance.
+        """
+        return self.within(x - radius, y - radius, x + radius, y + radius)
+
+    def within(self, x0, y0, x1, y1):
+        """Returns the indices in all cells overlapping a box
+
+        Candidates still have to be checked for their actual position.
+        """
+        c0, r0 = self.cell(x0, y0)
+        c1, r1 = self.cell(x1, y1)
+        cells = self.cells
+        found = []
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > len(cells):
+            # the box covers more cells than are occupied
+            for (c, r), bucket in cells.items():
+                if c0 <= c <= c1 and r0 <= r <= r1:
+                    found.extend(bucket)
+            return found
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                bucket = cells.get((c, r))
+                if bucket:
+                    found.extend(bucket)
+        return found
+
+class AnchorIndex:
+    """Finds entourages by their anchors on the XY plane
+
+    Indexed anchors are kept in a SpatialHash whose cells hold a few
+    anchors each on average, so radius, box, polygon and nearest queries
+    only visit the cells they cover.
+
+    Args:
+        xs, ys (list of float): anchor coordinates of every entourage
+        indices (iterable of int): (Optional) the entourages to index,
+            all by default
+    """
+    def __init__(self, xs, ys, indices=None):
+        self.xs, self.ys = xs, ys
+        if indices is None:
+            indices = range(len(xs))
+        indices = list(indices)
+        self.grid = SpatialHash(gridSize([xs[i] for i in indices],
+                                         [ys[i] for i in indices]))
+        self.size = 0
+        for i in indices:
+            self.insert(i)
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, i):
+        self.grid.insert(i, self.xs[i], self.ys[i])
+        self.size += 1
+
+    def remove(self, i):
+        self.grid.remove(i, self.xs[i], self.ys[i])
+        self.size -= 1
+
+    def radius(self, x, y, radius):
+        """Returns the indices of the anchors within radius of (x, y)"""
+        xs, ys, r2 = self.xs, self.ys, radius*radius
+        return sorted(i for i in self.grid.near(x, y, radius)
+                      if (xs[i] - x)**2 + (ys[i] - y)**2 <= r2)
+
+    def box(self, x0, y0, x1, y1):
+        """Returns the indices of the anchors inside a box"""
+        xs, ys = self.xs, self.ys
+        return sorted(i for i in self.grid.within(x0, y0, x1, y1)
+                      if x0 <= xs[i] <= x1 and y0 <= ys[i] <= y1)
+
+    def polygon(self, loops):
+        """Returns the indices of the anchors inside the loops by the
+        even-odd rule
+
+        Args:
+            loops (list): closed polygons as lists of (x, y), holes included
+        """
+        points = [p for loop in loops for p in loop]
+        if not points:
+            return []
+        px, py = [p[0] for p in points], [p[1] for p in points]
+        xs, ys = self.xs, self.ys
+        return [i for i in self.box(min(px), min(py), max(px), max(py))
+                if pointInLoops(xs[i], ys[i], loops)]
+
+    def nearest(self, x, y):
+        """Returns the index of the anchor closest to (x, y), or None if
+        nothing is indexed
+
+        Searches squares of cells growing around the point until one
+        holds an anchor within its inner radius.
+        """
+        if not self.size:
+            return None
+        xs, ys = self.xs, self.ys
+        radius = self.grid.cellSize
+        while True:
+            found = self.grid.near(x, y, radius)
+            if len(found) == self.size:
+                return min(found, key=lambda i: (xs[i] - x)**2 +
+                           (ys[i] - y)**2)
+            found = self.radius(x, y, radius)
+            if found:
+                return min(found, key=lambda i: (xs[i] - x)**2 +
+                           (ys[i] - y)**2)
+            radius *= 2
+
+def gridSize(xs, ys, perCell=4):
+    """Returns a cell size holding perCell of the anchors on average"""
+    if len(xs) < 2:
+        return 1.0
+    area = (max(xs) - min(xs)) * (max(ys) - min(ys))
+    return math.sqrt(area * perCell / len(xs)) or 1.0
+
+def resolveOverlaps(xs, ys, widths, seed, nudge=True, attempts=4):
+    """Drops or nudges anchors whose entourages overlap
+
+    Anchors are visited in a seeded random order, and each one is kept if
+    its entourage (a disk as wide as the image) overlaps none of the kept
+    ones. A colliding anchor is pushed away from what it collides with, at
+    most half its width in total, before it is dropped.
+
+    Args:
+        xs, ys (list of float): anchor coordinates
+        widths (list of float): the scaled image width of every anchor
+        seed (int): random seed for the visiting order
+        nudge (bool): tries moving colliding anchors before dropping them
+        attempts (int): the number of pushes per anchor
+    Returns:
+        (xs, ys, dropped) the resolved coordinates and a flag per anchor
+    """
+    n = len(xs)
+    radii = [0.5*(w or 0.0) for w in widths]
+    maxRadius = max(radii) if radii else 0.0
+    outX, outY = list(xs), list(ys)
+    dropped = [False]*n
+    if maxRadius <= 0:
+        return outX, outY, dropped
+    rnd = random.Random(seed)
+    order = list(range(n))
+    rnd.shuffle(order)
+    # Cells are keyed by one integer rather than (column, row) and hold the
+    # (x, y, radius) of the kept anchors, and the neighbor search is
+    # inlined: this loop dominates the time of resolving large scenes.
+    inv = 1 / (2*maxRadius)
+    floor, sqrt = math.floor, math.sqrt
+    cells = {}
+    # reaches are at most one cell wide, so the 3x3 block suffices; the
+    # anchor's own cell comes first as it is the likeliest to collide
+    block = [0] + [c*CELL_STRIDE + w for c in (-1, 0, 1) for w in (-1, 0, 1)
+                   if c or w]
+    for i in order:
+        x0, y0, r = xs[i], ys[i], radii[i]
+        x, y = x0, y0
+        tries = attempts if nudge else 0
+        while True:
+            key = int(floor(x*inv))*CELL_STRIDE + int(floor(y*inv))
+            hit = None
+            for offset in block:
+                bucket = cells.get(key + offset)
+                if bucket:
+                    for kept in bucket:
+                        kx, ky, kr = kept
+                        dx, dy = x - kx, y - ky
+                        reach = r + kr
+                        if dx*dx + dy*dy < reach*reach:
+                            hit = kept
+                            break
+                    if hit is not None:
+                        break
+            if hit is None or not tries:
+                break
+            tries -= 1
+            dx, dy = x - hit[0], y - hit[1]
+            d = sqrt(dx*dx + dy*dy)
+            if d > 0:
+                ux, uy = dx/d, dy/d
+            else:
+                angle = rnd.random()*2*math.pi
+                ux, uy = math.cos(angle), math.sin(angle)
+            push = (r + hit[2])*(1 + 1e-9) - d
+            x, y = x + ux*push, y + uy*push
+            if (x - x0)**2 + (y - y0)**2 > r*r:
+                break
+        if hit is not None or (x - x0)**2 + (y - y0)**2 > r*r:
+            dropped[i] = True
+            continue
+        outX[i], outY[i] = x, y
+        bucket = cells.get(key)
+        if bucket is None:
+            cells[key] = [(x, y, r)]
+        else:
+            bucket.append((x, y, r))
+    return outX, outY, dropped
+
+def spreadAssign(xs, ys, libraries, radius, seed):
+    """Assigns an item of its library to every anchor so that identical
+    items are not within radius of each other
+
+    Anchors are visited in a seeded random order and take the first item,
+    from a random start in their library, that no assigned neighbor within
+    radius has. Where the whole library is taken nearby, the item at the
+    random start is used anyway.
+
+    Args:
+        xs, ys (list of float): anchor coordinates
+        libraries (list of list): the candidate items of every anchor
+        radius (float): the minimum distance between identical items
+        seed (int): random seed for the visiting order and the picks
+    Returns:
+        a list of the assigned items
+    """
+    n = len(xs)
+    rnd = random.Random(seed)
+    order = list(range(n))
+    rnd.shuffle(order)
+    chosen = [None]*n
+    # every cell maps the items assigned in it to their anchors
+    grid = SpatialHash(radius) if radius > 0 else None
+    reach = radius*radius
+
+    def taken(item, x, y):
+        c, w = grid.cell(x, y)
+        for key in ((c-1, w-1), (c, w-1), (c+1, w-1), (c-1, w), (c, w),
+                    (c+1, w), (c-1, w+1), (c, w+1), (c+1, w+1)):
+            bucket = grid.cells.get(key)
+            if bucket:
+                for j in bucket.get(item, ()):
+                    if (x - xs[j])**2 + (y - ys[j])**2 < reach:
+                        return True
+        return False
+
+    for i in order:
+        library = libraries[i]
+        if not library:
+            continue
+        start = rnd.randrange(len(library))
+        pick = library[start]
+        if grid is not None:
+            x, y = xs[i], ys[i]
+            for k in range(len(library)):
+                item = library[(start + k) % len(library)]
+                if not taken(item, x, y):
+                    pick = item
+                    break
+            grid.cells.setdefault(grid.cell(x, y), {}).setdefault(
+                pick, []).append(i)
+        chosen[i] = pick
+    return chosen
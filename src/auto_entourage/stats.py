@@ -0,0 +1,77 @@
+"""Per-phase timers and counters for diagnosing slow loads
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import collections
+import contextlib
+import json
+import time
+
+class Stats(object):
+    """Accumulates the wall time of named phases and named counters
+
+    Args:
+        clock (callable): returns the current time in seconds
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """Starts a new run"""
+        self.started = self.clock()
+        self.timings = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the with block and adds it to the phase name"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.timings[name] = (self.timings.get(name, 0.0) +
+                                  self.clock() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def enter(self, name, context):
+        """Returns a wrapper of a context manager that only times entering
+        it (e.g. deleting the old layer in NewLayerContext)"""
+        return _TimedEnter(self, name, context)
+
+    def snapshot(self, **extra):
+        """Returns the run as a dict of JSON types
+
+        Args:
+            extra: more entries, e.g. cache statistics
+        """
+        record = collections.OrderedDict()
+        record["started"] = self.started
+        record["totalMs"] = round((self.clock() - self.started) * 1000, 3)
+        record["phasesMs"] = collections.OrderedDict(
+            (name, round(seconds * 1000, 3))
+            for name, seconds in self.timings.items())
+        record["counters"] = collections.OrderedDict(self.counters)
+        record.update(extra)
+        return record
+
+def appendLog(path, record):
+    """Appends a record to a JSON lines file"""
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+class _TimedEnter(object):
+    def __init__(self, stats, name, context):
+        self.stats = stats
+        self.name = name
+        self.context = context
+
+    def __enter__(self):
+        with self.stats.phase(self.name):
+            return self.context.__enter__()
+
+    def __exit__(self, type, value, traceback):
+        return self.context.__exit__(type, value, traceback)
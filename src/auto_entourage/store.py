@@ -0,0 +1,147 @@
+"""Flat, array-backed store of the loaded entourages
+"""
+__author__ = "Vincent Mai"
+__version__ = "0.5.0"
+
+import sys
+from array import array
+
+from persist import internPaths
+from spatial import AnchorIndex
+
+def denseColumns(keys, columns, empty):
+    """Returns the keys and columns of some items with an empty item
+    wherever a branch skips an index, as keys() assumes every index of a
+    branch up to its last
+
+    Args:
+        keys (list of (str, int)): the (path, index) key of every item
+        columns (list of list): the values of every item
+        empty (tuple): the value of each column for a skipped index
+    Returns:
+        (keys, columns) as lists
+    """
+    dense = [[] for _ in columns]
+    denseKeys = []
+    following = {}
+    for key, values in zip(keys, zip(*columns)):
+        branch, j = key
+        for gap in range(following.get(branch, 0), j):
+            denseKeys.append((branch, gap))
+            for column, value in zip(dense, empty):
+                column.append(value)
+        denseKeys.append(key)
+        for column, value in zip(dense, values):
+            column.append(value)
+        following[branch] = j + 1
+    return denseKeys, dense
+
+def meshSlots(guids):
+    """Returns the position of every item among the ones sharing its
+    object id, which is its quad in a merged mesh none was deleted from"""
+    counts = {}
+    slots = []
+    for guid in guids:
+        slots.append(counts.get(guid, 0))
+        counts[guid] = slots[-1] + 1
+    return slots
+
+class EntourageStore(object):
+    """Holds one entourage per item, in the order of the matched tree
+
+    This is the only copy of the loaded entourages the component keeps.
+    The tree paths are kept as runs of branches and offsets, from which
+    keys() rebuilds the item keys. The GUID objects and the index by
+    GUID are kept as they are, so the component state is only a little
+    smaller than the trees it replaces.
+
+    Args:
+        keys (list of (str, int)): the (path, index) key of every item
+        guids (list): the object id of every item, or None
+        anchors (list of (float, float, float)): the anchor coordinates
+        paths (list of str): (Optional) the image path of every item
+        heights (list of float): (Optional) the target height of every
+            item
+        slots (list of int): (Optional) the quad of every item in its
+            merged mesh
+    """
+    __slots__ = ("anchors", "yaws", "images", "paths", "heights", "guids",
+                 "slots", "index", "branches", "offsets", "spatial")
+
+    def __init__(self, keys, guids, anchors, paths=None, heights=None,
+                 slots=None):
+        self.anchors = array("d", [c for a in anchors for c in a])
+        self.yaws = array("f", [0.0]) * len(guids)
+        self.paths, images = internPaths(paths or [None]*len(guids))
+        self.images = array("i", images)
+        self.heights = array("d", [h or 0.0 for h in
+                                   heights or [0.0]*len(guids)])
+        self.guids = list(guids)
+        self.slots = None if slots is None else array("i", slots)
+        self.index = dict((g, i) for i, g in enumerate(self.guids)
+                          if g is not None)
+        self.branches = []
+        self.offsets = array("l")
+        for i, (path, _) in enumerate(keys):
+            if not self.branches or self.branches[-1] != path:
+                self.branches.append(path)
+                self.offsets.append(i)
+        self.offsets.append(len(keys))
+        self.spatial = None
+
+    def __len__(self):
+        return len(self.guids)
+
+    def find(self, guid):
+        """Returns the index of the entourage with the id, or None"""
+        return self.index.get(guid)
+
+    def anchor(self, i):
+        return tuple(self.anchors[3*i:3*i+3])
+
+    def image(self, i):
+        return self.paths[self.images[i]]
+
+    def keys(self):
+        """Returns the (path, index) key of every item"""
+        return [(path, j) for path, start, end in
+                zip(self.branches, self.offsets, self.offsets[1:])
+                for j in range(end - start)]
+
+    def setYaws(self, yaws):
+        """Replaces the yaw (in degrees) of every entourage"""
+        self.yaws = array("f", yaws)
+
+    def spatialIndex(self):
+        """Returns the AnchorIndex of the placed entourages, built on first
+        use and kept up to date by replaceGuids"""
+        if self.spatial is None:
+            self.spatial = AnchorIndex(
+                self.anchors[0::3], self.anchors[1::3],
+                [i for i, g in enumerate(self.guids) if g is not None])
+        return self.spatial
+
+    def replaceGuids(self, indices, guids):
+        """Updates the object ids of the entourages at indices, None
+        marking removed ones"""
+        for i, guid in zip(indices, guids):
+            old = self.guids[i]
+            if old is not None and self.index.get(old) == i:
+                del self.index[old]
+            self.guids[i] = guid
+            if guid is not None:
+                self.index[guid] = i
+            if self.spatial is not None and (old is None) != (guid is None):
+                if guid is None:
+                    self.spatial.remove(i)
+                else:
+                    self.spatial.insert(i)
+
+    def nbytes(self):
+        """Returns the approximate memory use in bytes, not counting the
+        shared path strings and GUID objects"""
+        size = sys.getsizeof
+        return (size(self.anchors) + size(self.yaws) + size(self.images) +
+                size(self.heights) + size(self.guids) + size(self.index) +
+                size(self.offsets) + size(self.paths) + size(self.branches) +
+                size(self.slots))